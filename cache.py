@@ -0,0 +1,109 @@
+import json
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+
+class Measurement(namedtuple("Measurement", ["id", "station", "timestamp", "temperature", "humidity"])):
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, payload):
+        # payload of a measurement notification, sent by the database trigger
+        values = json.loads(payload)
+        timestamp = values["timestamp"]
+        if isinstance(timestamp, str):
+            # sent by a trigger from before the epoch timestamps
+            timestamp = datetime.fromisoformat(timestamp)
+        else:
+            timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+        return cls(
+            values["id"],
+            values["station"],
+            timestamp,
+            values["temperature"],
+            values["humidity"]
+        )
+
+
+class MeasurementCache:
+    # Keeps the latest measurements of every station in fixed-size ring buffers.
+    # It's loaded from the database once and then kept current by notifications
+
+    def __init__(self, stations=("T1", "T2"), size=30):
+        # number of measurements kept per station
+        self.size = size
+
+        self.__stations = {station: deque(maxlen=size) for station in stations}
+        self.__latest = deque(maxlen=size)
+        self.__last_id = 0
+        self.__ready = False
+        self.__subscribers = []
+
+    def load(self, measurements):
+        # replace the content with the given (id, station, timestamp, temperature, humidity) records
+        previous = self.__last_id
+        for buffer in self.__stations.values():
+            buffer.clear()
+        self.__latest.clear()
+        self.__last_id = 0
+
+        for measurement in sorted(measurements, key=lambda m: m[0]):
+            self.append(Measurement._make(measurement))
+
+        self.__ready = True
+
+        # measurements added while the cache wasn't current (the listener
+        # reconnected) haven't been sent to the subscribers yet
+        if previous:
+            for measurement in self.since(previous):
+                for subscriber in self.__subscribers:
+                    subscriber(measurement)
+
+    def append(self, measurement):
+        # measurements loaded and notified at the same time are only kept once
+        if measurement.id <= self.__last_id:
+            return
+
+        self.__last_id = measurement.id
+        self.__latest.append(measurement)
+        if measurement.station in self.__stations:
+            self.__stations[measurement.station].append(measurement)
+
+        if self.__ready:
+            for subscriber in self.__subscribers:
+                subscriber(measurement)
+
+    def subscribe(self, subscriber):
+        # subscriber is called with every new measurement
+        self.__subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.__subscribers.remove(subscriber)
+
+    def invalidate(self):
+        self.__ready = False
+
+    def station(self, station):
+        # oldest measurement first
+        return list(self.__stations.get(station, ()))
+
+    def latest(self, limit=None):
+        # newest measurement first
+        latest = list(reversed(self.__latest))
+        return latest[:limit]
+
+    def since(self, last_id):
+        # measurements newer than last_id, oldest first
+        return [measurement for measurement in self.__latest if measurement.id > last_id]
+
+    @property
+    def stations(self):
+        return list(self.__stations)
+
+    @property
+    def last_id(self):
+        return self.__last_id
+
+    @property
+    def ready(self):
+        return self.__ready
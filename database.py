@@ -1,95 +1,817 @@
+import time
+import select
+import argparse
+from datetime import datetime, timedelta, timezone
+import logging
+import threading
+from contextlib import contextmanager
+from queue import Queue, Full, Empty
 import psycopg2
+import psycopg2.extras
+from psycopg2 import sql
+import metrics
+
+
+# Builds the hourly and daily aggregates (rollups) from all raw measurements, when the
+# rollups are created. Buckets are aligned to UTC, like the buckets of get_aggregates()
+ROLLUP_BACKFILL = """
+    TRUNCATE measurement_hourly, measurement_daily;
+    INSERT INTO measurement_hourly
+        SELECT station, DATE_TRUNC('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', COUNT(*),
+            MIN(temperature), MAX(temperature), SUM(temperature),
+            MIN(humidity), MAX(humidity), SUM(humidity)
+        FROM measurement
+        GROUP BY 1, 2;
+    INSERT INTO measurement_daily
+        SELECT station, DATE_TRUNC('day', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', COUNT(*),
+            MIN(temperature), MAX(temperature), SUM(temperature),
+            MIN(humidity), MAX(humidity), SUM(humidity)
+        FROM measurement
+        GROUP BY 1, 2;
+"""
+
+# Rebuilds the aggregates of the buckets which still have all of their raw measurements,
+# i.e. the buckets starting at or after the oldest measurement. Older buckets keep the
+# history of the measurements deleted by the retention
+ROLLUP_REBUILD = """
+    DELETE FROM measurement_hourly WHERE bucket >= (SELECT MIN(timestamp) FROM measurement);
+    INSERT INTO measurement_hourly
+        SELECT * FROM (
+            SELECT station, DATE_TRUNC('hour', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS bucket, COUNT(*),
+                MIN(temperature), MAX(temperature), SUM(temperature),
+                MIN(humidity), MAX(humidity), SUM(humidity)
+            FROM measurement
+            GROUP BY 1, 2
+        ) AS rollup
+        WHERE bucket >= (SELECT MIN(timestamp) FROM measurement);
+    DELETE FROM measurement_daily WHERE bucket >= (SELECT MIN(timestamp) FROM measurement);
+    INSERT INTO measurement_daily
+        SELECT * FROM (
+            SELECT station, DATE_TRUNC('day', timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS bucket, COUNT(*),
+                MIN(temperature), MAX(temperature), SUM(temperature),
+                MIN(humidity), MAX(humidity), SUM(humidity)
+            FROM measurement
+            GROUP BY 1, 2
+        ) AS rollup
+        WHERE bucket >= (SELECT MIN(timestamp) FROM measurement);
+"""
+
+# Schema migrations, applied in order by DatabaseConnector.setup(). The number
+# of applied migrations is kept in schema_version. Never change an existing
+# migration, append a new one instead
+MIGRATIONS = [
+    # initial schema
+    """
+    CREATE TABLE IF NOT EXISTS measurement (
+        id SERIAL,
+        station VARCHAR(2),
+        timestamp TIMESTAMP,
+        temperature FLOAT,
+        humidity FLOAT,
+        raw VARCHAR(36)
+    );
+    """,
+    # primary key, typed columns and an index for the per station queries
+    """
+    ALTER TABLE measurement
+        ADD PRIMARY KEY (id),
+        ALTER COLUMN station TYPE CHAR(2),
+        ALTER COLUMN timestamp TYPE TIMESTAMPTZ USING timestamp::timestamptz,
+        ALTER COLUMN temperature TYPE REAL,
+        ALTER COLUMN humidity TYPE REAL,
+        ALTER COLUMN raw TYPE BIGINT USING raw::bit(36)::bigint;
+    CREATE INDEX IF NOT EXISTS measurement_station_timestamp_idx
+        ON measurement (station, timestamp DESC);
+    """,
+    # notify listeners (the REST API cache) about every new measurement
+    """
+    CREATE OR REPLACE FUNCTION measurement_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('measurement', json_build_object(
+            'id', NEW.id,
+            'station', NEW.station,
+            'timestamp', NEW.timestamp,
+            'temperature', NEW.temperature,
+            'humidity', NEW.humidity
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER measurement_notify AFTER INSERT ON measurement
+        FOR EACH ROW EXECUTE PROCEDURE measurement_notify();
+    """,
+    # hourly and daily aggregates, kept up to date with every insert
+    """
+    CREATE TABLE measurement_hourly (
+        station CHAR(2) NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+        count INTEGER NOT NULL,
+        temperature_min REAL,
+        temperature_max REAL,
+        temperature_sum DOUBLE PRECISION,
+        humidity_min REAL,
+        humidity_max REAL,
+        humidity_sum DOUBLE PRECISION,
+        PRIMARY KEY (station, bucket)
+    );
+    CREATE TABLE measurement_daily (LIKE measurement_hourly INCLUDING ALL);
+    CREATE OR REPLACE FUNCTION measurement_rollup() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO measurement_hourly AS rollup VALUES (
+            NEW.station, DATE_TRUNC('hour', NEW.timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', 1,
+            NEW.temperature, NEW.temperature, NEW.temperature,
+            NEW.humidity, NEW.humidity, NEW.humidity
+        ) ON CONFLICT (station, bucket) DO UPDATE SET
+            count = rollup.count + 1,
+            temperature_min = LEAST(rollup.temperature_min, EXCLUDED.temperature_min),
+            temperature_max = GREATEST(rollup.temperature_max, EXCLUDED.temperature_max),
+            temperature_sum = rollup.temperature_sum + EXCLUDED.temperature_sum,
+            humidity_min = LEAST(rollup.humidity_min, EXCLUDED.humidity_min),
+            humidity_max = GREATEST(rollup.humidity_max, EXCLUDED.humidity_max),
+            humidity_sum = rollup.humidity_sum + EXCLUDED.humidity_sum;
+        INSERT INTO measurement_daily AS rollup VALUES (
+            NEW.station, DATE_TRUNC('day', NEW.timestamp AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', 1,
+            NEW.temperature, NEW.temperature, NEW.temperature,
+            NEW.humidity, NEW.humidity, NEW.humidity
+        ) ON CONFLICT (station, bucket) DO UPDATE SET
+            count = rollup.count + 1,
+            temperature_min = LEAST(rollup.temperature_min, EXCLUDED.temperature_min),
+            temperature_max = GREATEST(rollup.temperature_max, EXCLUDED.temperature_max),
+            temperature_sum = rollup.temperature_sum + EXCLUDED.temperature_sum,
+            humidity_min = LEAST(rollup.humidity_min, EXCLUDED.humidity_min),
+            humidity_max = GREATEST(rollup.humidity_max, EXCLUDED.humidity_max),
+            humidity_sum = rollup.humidity_sum + EXCLUDED.humidity_sum;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER measurement_rollup AFTER INSERT ON measurement
+        FOR EACH ROW EXECUTE PROCEDURE measurement_rollup();
+    """ + ROLLUP_BACKFILL,
+    # notify the timestamp as seconds since the epoch, the ISO format of Postgres
+    # (trailing zeros of the fraction dropped) isn't read by every Python version
+    """
+    CREATE OR REPLACE FUNCTION measurement_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('measurement', json_build_object(
+            'id', NEW.id,
+            'station', NEW.station,
+            'timestamp', EXTRACT(EPOCH FROM NEW.timestamp),
+            'temperature', NEW.temperature,
+            'humidity', NEW.humidity
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    # station names of other protocols are longer than the ones of TEKO (T1, T2)
+    """
+    ALTER TABLE measurement ALTER COLUMN station TYPE VARCHAR(16);
+    ALTER TABLE measurement_hourly ALTER COLUMN station TYPE VARCHAR(16);
+    ALTER TABLE measurement_daily ALTER COLUMN station TYPE VARCHAR(16);
+    """,
+]
+
+# maximum length of a station name (measurement.station)
+STATION_LENGTH = 16
+
+# rollup tables by bucket size (seconds), coarsest first
+ROLLUPS = [(86400, "measurement_daily"), (3600, "measurement_hourly")]
+
+# Converts measurement into a table partitioned by month. The existing rows
+# are kept in the default partition, until the retention deleted them
+PARTITION = """
+    LOCK TABLE measurement IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE measurement RENAME TO measurement_unpartitioned;
+    ALTER INDEX measurement_station_timestamp_idx RENAME TO measurement_unpartitioned_station_timestamp_idx;
+    DROP TRIGGER measurement_notify ON measurement_unpartitioned;
+    DROP TRIGGER measurement_rollup ON measurement_unpartitioned;
+
+    -- rows without a timestamp can't be assigned to a partition (nor shown anywhere)
+    DELETE FROM measurement_unpartitioned WHERE timestamp IS NULL;
+    ALTER TABLE measurement_unpartitioned ALTER COLUMN timestamp SET NOT NULL;
+
+    CREATE TABLE measurement (LIKE measurement_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp);
+    ALTER TABLE measurement ADD PRIMARY KEY (id, timestamp);
+    CREATE INDEX measurement_station_timestamp_idx ON measurement (station, timestamp DESC);
+    ALTER TABLE measurement ATTACH PARTITION measurement_unpartitioned DEFAULT;
+    ALTER SEQUENCE measurement_id_seq OWNED BY measurement.id;
+
+    CREATE TRIGGER measurement_notify AFTER INSERT ON measurement
+        FOR EACH ROW EXECUTE PROCEDURE measurement_notify();
+    CREATE TRIGGER measurement_rollup AFTER INSERT ON measurement
+        FOR EACH ROW EXECUTE PROCEDURE measurement_rollup();
+"""
 
 
 class DatabaseError(Exception):
     pass
 
 
+class DatabaseUnavailableError(DatabaseError):
+    # the connection failed, the same statement may succeed later
+    pass
+
+
+def gevent_wait_callback(connection, timeout=None):
+    # psycopg2 wait callback, which lets other greenlets run while a query waits on the socket
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError("Bad result from poll: " + str(state))
+
+
+class ConnectionPool:
+    # Bounded pool of database connections. A connection is checked out for a
+    # single operation, broken connections are replaced on the next checkout
+
+    def __init__(self, connect, size=1, semaphore=threading.BoundedSemaphore, health_check=30):
+        self.__connect = connect
+        self.__slots = semaphore(size)
+        self.__idle = []
+
+        # run a health check on connections which were idle for this many seconds
+        self.health_check = health_check
+
+        self.size = size
+
+    @contextmanager
+    def connection(self):
+        self.__slots.acquire()
+        try:
+            connection = self.checkout()
+            try:
+                yield connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # the connection is most likely broken, don't hand it out again
+                connection.close()
+                raise
+            finally:
+                if not connection.closed:
+                    self.__idle.append((connection, time.monotonic()))
+        finally:
+            self.__slots.release()
+
+    def checkout(self):
+        while self.__idle:
+            connection, since = self.__idle.pop()
+            if connection.closed:
+                continue
+            if time.monotonic() - since < self.health_check or self.alive(connection):
+                return connection
+            connection.close()
+
+        return self.__connect()
+
+    @staticmethod
+    def alive(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def close(self):
+        while self.__idle:
+            connection, since = self.__idle.pop()
+            connection.close()
+
+
 class DatabaseConnector:
 
-    def __init__(self):
-        self.__connection = None
-        self.__cursor = None
+    def __init__(self, pool_size=1, green=False, retention=timedelta(days=365), schema=None):
+        # maximum number of connections used at the same time
+        self.pool_size = pool_size
+
+        # wait on the database cooperatively, when used from gevent greenlets
+        self.green = green
+
+        # raw measurements older than this are deleted by maintain() (None
+        # keeps them forever). The hourly and daily rollups are kept
+        self.retention = retention
+
+        # schema holding the tables, None uses the default schema (public)
+        self.schema = schema
+
+        self.__pool = None
 
     def connect(self, filepath=None):
+        semaphore = threading.BoundedSemaphore
+        if self.green:
+            import gevent.lock
+            semaphore = gevent.lock.BoundedSemaphore
+            psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+
+        self.__pool = ConnectionPool(self.open, size=self.pool_size, semaphore=semaphore)
+
+        # make sure the database is reachable
+        with self.connection():
+            pass
+
+    def open(self):
         try:
-            self.__connection = psycopg2.connect(
+            connection = psycopg2.connect(
                 host="localhost",
                 database="measurement",
                 user="measurement",
-                password="measurement"
+                password="measurement",
+                options="-c search_path=" + self.schema if self.schema else None
             )
-        except psycopg2.errors as er:
+        except psycopg2.OperationalError as er:
+            raise DatabaseUnavailableError("The database is unavailable, couldn't connect")
+        except psycopg2.Error as er:
             raise DatabaseError("Something went wrong while connecting to the database")
 
-        self.__connection.autocommit = True
-        self.__cursor = self.__connection.cursor()
+        connection.autocommit = True
+        return connection
 
     def disconnect(self):
-        self.__connection.commit()
-        self.__connection.close()
+        self.__pool.close()
+
+    @contextmanager
+    def connection(self):
+        with self.__pool.connection() as connection:
+            yield connection
+
+    @contextmanager
+    def cursor(self):
+        with self.__pool.connection() as connection:
+            with connection.cursor() as cursor:
+                yield cursor
 
     def setup(self):
         try:
-            self.__cursor.execute("""
-                CREATE TABLE IF NOT EXISTS measurement (
-                    id SERIAL,
-                    station VARCHAR(2),
-                    timestamp TIMESTAMP,
-                    temperature FLOAT,
-                    humidity FLOAT,
-                    raw VARCHAR(36)
-                );
-            """)
-        except psycopg2.errors as er:
+            with self.connection() as connection:
+                with connection.cursor() as cursor:
+                    if self.schema:
+                        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {};").format(sql.Identifier(self.schema)))
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_version (
+                            version INTEGER NOT NULL
+                        );
+                    """)
+
+                # migrations run in one transaction, the lock keeps
+                # a second process from migrating at the same time
+                connection.autocommit = False
+                try:
+                    with connection, connection.cursor() as cursor:
+                        cursor.execute("LOCK TABLE schema_version IN EXCLUSIVE MODE;")
+                        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+                        version = cursor.fetchone()[0]
+
+                        for migration in MIGRATIONS[version:]:
+                            cursor.execute(migration)
+
+                        if version < len(MIGRATIONS):
+                            cursor.execute("DELETE FROM schema_version;")
+                            cursor.execute("INSERT INTO schema_version (version) VALUES (%(version)s);",
+                                           {"version": len(MIGRATIONS)})
+                finally:
+                    connection.autocommit = True
+        except psycopg2.Error as er:
             raise DatabaseError("Something went wrong while setting up the database")
 
     def get_measurement(self, limit=1):
         try:
-            self.__cursor.execute("""
-                SELECT *
-                FROM measurement
-                ORDER BY id DESC
-                LIMIT %(limit)s
-            """, {"limit": limit})
-            records = self.__cursor.fetchall()
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT *
+                    FROM measurement
+                    ORDER BY id DESC
+                    LIMIT %(limit)s
+                """, {"limit": limit})
+                records = cursor.fetchall()
             return records
-        except psycopg2.errors as er:
+        except psycopg2.Error as er:
             raise DatabaseError("Something went wrong while reading from the database")
 
     def get_measurement_by_station(self, limit=1, station="T1"):
         try:
-            self.__cursor.execute("""
-                SELECT temperature, humidity, timestamp
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT temperature, humidity, timestamp
+                    FROM measurement
+                    WHERE station = %(station)s
+                    ORDER BY timestamp DESC
+                    LIMIT %(limit)s
+                """, {"limit": limit,
+                      "station": station})
+                records = cursor.fetchall()
+            return records
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while reading from the database")
+
+    def get_latest_by_station(self, limit=1, station="T1"):
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, station, timestamp, temperature, humidity
+                    FROM measurement
+                    WHERE station = %(station)s
+                    ORDER BY timestamp DESC
+                    LIMIT %(limit)s
+                """, {"limit": limit,
+                      "station": station})
+                records = cursor.fetchall()
+            return records
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while reading from the database")
+
+    def get_aggregates(self, start, end, resolution, stations=("T1", "T2")):
+        # min/avg/max of temperature and humidity in buckets of resolution
+        # seconds. Returns (station, bucket epoch, t min, t avg, t max, h min, h avg, h max).
+        # The coarsest rollup table the resolution is a multiple of is used, if any
+        table = next((table for size, table in ROLLUPS if resolution % size == 0), None)
+
+        if table:
+            query = """
+                SELECT station,
+                    (FLOOR(EXTRACT(EPOCH FROM bucket) / %(resolution)s) * %(resolution)s)::BIGINT AS period,
+                    MIN(temperature_min), SUM(temperature_sum) / SUM(count), MAX(temperature_max),
+                    MIN(humidity_min), SUM(humidity_sum) / SUM(count), MAX(humidity_max)
+                FROM """ + table + """
+                WHERE station = ANY(%(stations)s)
+                    AND bucket >= %(start)s
+                    AND bucket < %(end)s
+                GROUP BY station, period
+                ORDER BY station, period
+            """
+        else:
+            query = """
+                SELECT station,
+                    (FLOOR(EXTRACT(EPOCH FROM timestamp) / %(resolution)s) * %(resolution)s)::BIGINT AS period,
+                    MIN(temperature), AVG(temperature), MAX(temperature),
+                    MIN(humidity), AVG(humidity), MAX(humidity)
                 FROM measurement
-                WHERE station = %(station)s
-                ORDER BY id DESC
-                LIMIT %(limit)s
-            """, {"limit": limit,
-                  "station": station})
-            records = self.__cursor.fetchall()
+                WHERE station = ANY(%(stations)s)
+                    AND timestamp >= %(start)s
+                    AND timestamp < %(end)s
+                GROUP BY station, period
+                ORDER BY station, period
+            """
+
+        try:
+            with self.cursor() as cursor:
+                cursor.execute(query, {"start": start,
+                                       "end": end,
+                                       "resolution": resolution,
+                                       "stations": list(stations)})
+                records = cursor.fetchall()
             return records
-        except psycopg2.errors as er:
+        except psycopg2.Error as er:
             raise DatabaseError("Something went wrong while reading from the database")
 
+    def drop_schema(self):
+        # drop the schema and everything in it, never the default schema
+        if not self.schema:
+            raise DatabaseError("Refusing to drop the default schema")
+        try:
+            with self.cursor() as cursor:
+                cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE;").format(sql.Identifier(self.schema)))
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while dropping the schema")
+
+    def backfill(self):
+        # rebuild the rollup tables, e.g. after measurements were imported or deleted.
+        # Buckets older than the oldest raw measurement are left alone
+        try:
+            with self.connection() as connection:
+                connection.autocommit = False
+                try:
+                    with connection, connection.cursor() as cursor:
+                        cursor.execute(ROLLUP_REBUILD)
+                finally:
+                    connection.autocommit = True
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while backfilling the rollups")
+
+    def listen(self, channel="measurement"):
+        # Yields the payload of every notification sent on channel. Yields None
+        # once the listener is registered, nothing sent afterwards is missed
+        connection = self.open()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("LISTEN " + channel + ";")
+            yield None
+
+            while True:
+                if self.green:
+                    from gevent.socket import wait_read
+                    wait_read(connection.fileno())
+                else:
+                    select.select([connection], [], [])
+
+                connection.poll()
+                while connection.notifies:
+                    yield connection.notifies.pop(0).payload
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while listening to the database")
+        finally:
+            connection.close()
+
     def add_measurement(self, station, timestamp, temperature, humidity, raw):
         try:
-            self.__cursor.execute("""
-                INSERT INTO measurement (station ,timestamp ,temperature ,humidity ,raw)
-                VALUES (%(station)s, %(timestamp)s, %(temperature)s, %(humidity)s, %(raw)s);
-            """, {"station": station,
-                  "timestamp": timestamp,
-                  "temperature": temperature,
-                  "humidity": humidity,
-                  "raw": raw})
-        except psycopg2.errors as er:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO measurement (station ,timestamp ,temperature ,humidity ,raw)
+                    VALUES (%(station)s, %(timestamp)s, %(temperature)s, %(humidity)s, %(raw)s);
+                """, {"station": station,
+                      "timestamp": timestamp,
+                      "temperature": temperature,
+                      "humidity": humidity,
+                      "raw": raw})
+        except psycopg2.Error as er:
             raise DatabaseError("Something went wrong while adding data to the database")
 
-    def clean(self):
-        pass
+    def add_measurements(self, measurements):
+        # insert many (station, timestamp, temperature, humidity, raw) rows in one statement
+        try:
+            with self.cursor() as cursor:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO measurement (station ,timestamp ,temperature ,humidity ,raw)
+                    VALUES %s;
+                """, measurements)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as er:
+            raise DatabaseUnavailableError("The database is unavailable, couldn't add data")
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while adding data to the database")
 
-    def drop(self):
-        pass
+    def clean(self, before, batch_size=1000):
+        # Delete the raw measurements older than before. Every batch is a
+        # statement of its own, so the table is never locked for long
+        deleted = 0
+        try:
+            while True:
+                with self.cursor() as cursor:
+                    cursor.execute("""
+                        DELETE FROM measurement
+                        WHERE id IN (
+                            SELECT id
+                            FROM measurement
+                            WHERE timestamp < %(before)s
+                            ORDER BY id
+                            LIMIT %(limit)s
+                        )
+                    """, {"before": before,
+                          "limit": batch_size})
+                    deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    return deleted
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while cleaning the database")
+
+    def partitioned(self):
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*)
+                    FROM pg_partitioned_table
+                    WHERE partrelid = 'measurement'::regclass
+                """)
+                return cursor.fetchone()[0] > 0
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while reading from the database")
+
+    def partition(self, months=2):
+        # switch to monthly partitions, old months can then be dropped as a whole
+        try:
+            with self.connection() as connection:
+                connection.autocommit = False
+                try:
+                    with connection, connection.cursor() as cursor:
+                        cursor.execute(PARTITION)
+                finally:
+                    connection.autocommit = True
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while partitioning the database")
+
+        self.create_partitions(months)
+
+    def create_partitions(self, months=2):
+        # Create the missing partitions of the next months. The current month
+        # is left out, as its rows may already be in the default partition
+        month = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        try:
+            with self.cursor() as cursor:
+                for _ in range(months):
+                    month = (month + timedelta(days=32)).replace(day=1)
+                    end = (month + timedelta(days=32)).replace(day=1)
+                    name = month.strftime("measurement_y%Ym%m")
+
+                    cursor.execute("SELECT to_regclass(%(name)s);", {"name": name})
+                    if cursor.fetchone()[0] is None:
+                        cursor.execute("CREATE TABLE " + name + " PARTITION OF measurement "
+                                       "FOR VALUES FROM (%(start)s) TO (%(end)s);", {"start": month, "end": end})
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while creating partitions")
+
+    def drop(self, before):
+        # Drop the monthly partitions which only hold measurements older than before
+        dropped = []
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("""
+                    SELECT child.relname
+                    FROM pg_inherits
+                    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                    WHERE pg_inherits.inhparent = 'measurement'::regclass
+                        AND child.relname LIKE 'measurement\\_y%'
+                """)
+                for (name,) in cursor.fetchall():
+                    month = datetime.strptime(name, "measurement_y%Ym%m").replace(tzinfo=timezone.utc)
+                    if (month + timedelta(days=32)).replace(day=1) <= before:
+                        cursor.execute("DROP TABLE " + name + ";")
+                        dropped.append(name)
+            return dropped
+        except psycopg2.Error as er:
+            raise DatabaseError("Something went wrong while dropping partitions")
+
+    def maintain(self):
+        # enforce the retention of raw measurements
+        if self.retention is None:
+            return
+
+        before = datetime.now(timezone.utc) - self.retention
+        if self.partitioned():
+            self.create_partitions()
+            for name in self.drop(before):
+                logging.info("Dropped partition " + name)
+
+        deleted = self.clean(before)
+        if deleted:
+            logging.info("Deleted " + str(deleted) + " measurement(s) older than " + str(before))
 
     def __iter__(self):
         pass
+
+
+class MeasurementWriter:
+    # Buffers decoded measurements and writes them in batches from a
+    # background thread, so decoding never waits on the database
+
+    def __init__(self, db, batch_size=50, flush_interval=1.0, backlog=10000, maintenance_interval=3600):
+        self.__db = db
+
+        # write as soon as this many measurements are buffered ...
+        self.batch_size = batch_size
+
+        # ... or the oldest buffered measurement is this old (seconds)
+        self.flush_interval = flush_interval
+
+        # maximum number of measurements waiting to be written
+        self.backlog = backlog
+
+        # run the database maintenance (retention) every this many seconds
+        self.maintenance_interval = maintenance_interval
+
+        # wait this many seconds before writing again while the database is
+        # unavailable, doubled after every failed attempt up to the maximum
+        self.retry_interval = 1.0
+        self.max_retry_interval = 60.0
+
+        self._queue = Queue(maxsize=backlog)
+        self._thread = None
+        self._backoff = 0
+        self._retry_at = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # write everything which is still buffered and wait for the writer
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def put(self, station, timestamp, temperature, humidity, raw):
+        measurement = (station, timestamp, temperature, humidity, raw)
+        try:
+            self._queue.put_nowait(measurement)
+        except Full:
+            # drop the oldest measurement to keep the backlog bounded
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                pass
+            logging.warning("Measurement backlog is full, dropped the oldest measurement")
+            self._queue.put_nowait(measurement)
+
+    def _run(self):
+        measurements = []
+        deadline = None
+        maintenance = time.monotonic()
+
+        while True:
+            if time.monotonic() >= maintenance:
+                self._maintain()
+                maintenance = time.monotonic() + self.maintenance_interval
+
+            timeout = maintenance - time.monotonic()
+            if deadline is not None:
+                timeout = min(deadline - time.monotonic(), timeout)
+            timeout = max(timeout, 0)
+
+            try:
+                measurement = self._queue.get(timeout=timeout)
+            except Empty:
+                measurement = False
+
+            if measurement:
+                measurements.append(measurement)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = len(measurements) >= self.batch_size or (deadline and time.monotonic() >= deadline)
+            if measurement is None or (due and time.monotonic() >= self._retry_at):
+                metrics.backlog.set(self._queue.qsize() + len(measurements))
+                measurements = self._flush(measurements)
+                deadline = max(time.monotonic() + self.flush_interval, self._retry_at) if measurements else None
+
+            if measurement is None:
+                break
+
+    def _flush(self, measurements):
+        if not measurements:
+            return measurements
+
+        before = time.perf_counter()
+        try:
+            self.__db.add_measurements(measurements)
+        except DatabaseUnavailableError as er:
+            # keep the measurements for the next attempt, as long as the backlog allows
+            self._postpone(er, len(measurements))
+            return measurements[-self.backlog:]
+        except DatabaseError as er:
+            # the database refuses some of the rows, which would fail every retry
+            logging.error("%s, writing %s measurement(s) one by one", er, len(measurements))
+            metrics.write_errors.inc()
+            return self._flush_rows(measurements)
+
+        metrics.write_latency.observe(time.perf_counter() - before)
+        metrics.rows.inc(len(measurements))
+        self._backoff = 0
+        self._retry_at = 0
+        return []
+
+    def _postpone(self, error, pending):
+        # back off before the next attempt to write
+        self._backoff = min(self._backoff * 2 or self.retry_interval, self.max_retry_interval)
+        self._retry_at = time.monotonic() + self._backoff
+        logging.error("%s (%s measurement(s) pending, retrying in %s s)", error, pending, self._backoff)
+        metrics.write_errors.inc()
+
+    def _flush_rows(self, measurements):
+        # write the rows one at a time and drop the rejected ones
+        for i, measurement in enumerate(measurements):
+            try:
+                self.__db.add_measurements([measurement])
+            except DatabaseUnavailableError as er:
+                self._postpone(er, len(measurements) - i)
+                return measurements[i:]
+            except DatabaseError as er:
+                logging.error("%s, dropped %s", er, measurement)
+                metrics.write_errors.inc()
+            else:
+                metrics.rows.inc()
+        return []
+
+    def _maintain(self):
+        try:
+            self.__db.maintain()
+        except DatabaseError as er:
+            logging.error(str(er))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintenance of the measurement database")
+    parser.add_argument("command", choices=["setup", "backfill", "clean", "partition"],
+                        help="setup: apply schema migrations / backfill: rebuild the hourly and daily rollups "
+                             "still covered by raw measurements / "
+                             "clean: delete measurements older than the retention / partition: partition by month")
+    parser.add_argument("-r", "--retention", type=int, default=365, help="Retention of raw measurements in days")
+    args = parser.parse_args()
+
+    db = DatabaseConnector(retention=timedelta(days=args.retention))
+    db.connect()
+    db.setup()
+    if args.command == "backfill":
+        db.backfill()
+    if args.command == "clean":
+        db.maintain()
+    if args.command == "partition":
+        if db.partitioned():
+            print("The measurement table is already partitioned")
+        else:
+            db.partition()
+    db.disconnect()
@@ -1,332 +1,590 @@
 import time
-import itertools
+import signal
 import logging
-from datetime import datetime
-from bitstring import BitArray
-
-# ID1  ->    ID 1
-# CH   ->    Channel
-# ID2  ->    ID 2
-# V    ->    Voltage (Battery ok/nok)
-# TR   ->    Temperature Trend (00 – stable, 01 – increasing, 10 – decreasing)
-# B    ->    Battery changed
-# TEMP ->    Temperature (500 -> 00.000 Degree)
-# HUM  ->    Humidity
-# FCS  ->    Frame Check Sequence (XOR separate for temp and hum?)
-
-# ID1   CH  ID2 V  TR  B  TEMP            HUM        FCS
-# 0010  00  11  0  01  0  0001 1111 0100  1001 1111  1110   / -00 Grad (T2)  500 -> 00.000 Degree
+import metrics
+from collections import Counter
+from queue import Empty
+import protocols
+from transport import EdgeBuffer, ticks_us, ticks_diff, ticks_datetime
+from database import MeasurementWriter, STATION_LENGTH
 
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
+# units of the printed fields
+UNITS = {"temperature": "°C", "humidity": "%"}
+
 
 class SignalDecoder:
 
-    def __init__(self, queue, db):
-        # predefined signal pulse-length
-        self.pulse_length = [0, 250, 500, 750]
+    def __init__(self, queue, db, autostart=True):
+        # known sensor protocols (register additional ones before the decoder is
+        # created) and the pulse-lengths of all of them
+        self.protocols = protocols.registry
+        self.pulse_length = self.protocols.pulse_length
+        self.quantizer = self.protocols.quantizer
+
+        # pulse-lengths carrying a bit, and ending a part
+        self.bits = self.protocols.bits
+        self.syncs = self.protocols.syncs
 
         # timeout indicating the end of a transmission
         self.part_timeout = 2000
 
+        # time (µs) after which the group of a sensor is finalized if it didn't
+        # receive another part, while other sensors keep the channel busy. A part
+        # takes ~25ms, so with several sensors a few lost repetitions add up quickly
+        self.group_timeout = 1000000
+
+        # finalize a group as soon as it reached its quorum
+        # instead of waiting for the end of the transmission
+        self.early_finalize = True
+
+        # maximum number of queued edge batches decoded in one go
+        self.batch_size = 16
+
+        # time (seconds) edges may be held back by the edge transport
+        self.flush_latency = 0.02
+
         # message queue receiving measurements from main process (gpio readings)
         self.queue = queue
 
-        # keep the last measurement for validation purposes
-        self.last_measurement = None
+        # print every saved recording
+        self.output = True
 
-        # create initial SignalGroup
-        self.group = SignalGroup()
+        # keep the last measurement of every sensor for validation purposes
+        self.last_measurements = {}
+
+        # the part currently received, and the groups of the current
+        # transmission by sensor (protocol and leading bits of their frames)
+        self.part = SignalPart()
+        self.groups = {}
 
         self.__db = db
+        self.__writer = MeasurementWriter(db)
         self.__running = False
         self.__distance = 0
         self.__timestamp = 0
+        self.__deadline = None
 
-        self.start()
+        if autostart:
+            self.start()
 
-    def start(self):
+    def open(self):
         # db connection
         self.__db.connect()
-        self.__db.drop()
         self.__db.setup()
+        self.__writer.start()
 
+    def shutdown(self):
+        # save the current group and everything the writer still buffers
+        self.close()
+        self.__writer.stop()
+
+    def start(self):
+        self.open()
+
+        # flush the buffered measurements when the main process terminates us
+        signal.signal(signal.SIGTERM, self.terminate)
+
+        try:
+            self.run()
+        finally:
+            # a second signal (Ctrl+C reaches us and the main process, which
+            # terminates us) must not interrupt the flush of the writer
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self.shutdown()
+
+    def run(self):
         # main loop
         self.__running = True
         while self.__running:
-            if not self.queue.empty():
-                item = self.queue.get()
-                self.decode(item)
-            else:
-                time.sleep(1)
+            # block until the next edge arrives. While a group is open we only
+            # wait until its deadline, so it gets closed right after its last edge
+            timeout = None
+            if self.__deadline is not None:
+                timeout = max(self.__deadline - time.monotonic(), 0)
+
+            try:
+                payload = self.queue.get(timeout=timeout)
+            except Empty:
+                self.close()
+                continue
+
+            self.sample()
+
+            # drain the edge batches which are already waiting in the queue
+            self.receive(payload)
+            for _ in range(self.batch_size - 1):
+                try:
+                    payload = self.queue.get_nowait()
+                except Empty:
+                    break
+                self.receive(payload)
+
+            self.__deadline = time.monotonic() + self.part_timeout / 1000000 + self.flush_latency
 
     def stop(self):
         self.__running = False
 
+    def sample(self):
+        # queue depth before the waiting batches are drained
+        try:
+            metrics.queue_depth.set(self.queue.qsize())
+        except NotImplementedError:
+            # not available on every platform (macOS)
+            pass
+
+    def terminate(self, signum, frame):
+        raise SystemExit(0)
+
+    def finalize(self, group):
+        # a group always holds an open (empty) part after its completed ones
+        metrics.parts_per_group.observe(len(group) - 1)
+        if self.validate(group):
+            self.save(group)
+            self.out(group)
+            self.last_measurements[group.sensor] = group
+            metrics.groups.inc(value="saved")
+            if group.last_tick is not None:
+                metrics.decode_latency.observe(ticks_diff(ticks_us(), group.last_tick) / 1000000)
+        elif group.rejection:
+            metrics.groups.inc(value=group.rejection)
+
+        # the group is done, remaining repetitions are ignored
+        group.close()
+
+    def close(self):
+        # the transmission has ended: we assume we now have a valid
+        # signal of every sensor to save and start over afterwards
+        self.route(self.__distance)
+        for group in self.groups.values():
+            if not group.closed:
+                self.finalize(group)
+
+        # reset
+        self.groups = {}
+        self.__deadline = None
+
+    def route(self, tick):
+        # the current part has ended at tick. Valid parts are added to the group
+        # of their sensor, so interleaved transmissions are decoded side by side
+        part = self.part
+        if len(part) == 0:
+            return
+        self.part = SignalPart()
+
+        if not part.valid:
+            return
+
+        self.expire(tick)
+
+        protocol = part.protocol
+        key = (protocol, protocol.key(part.frame))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = SignalGroup()
+
+        if group.insert(part, tick) and self.early_finalize and group.complete:
+            self.finalize(group)
+
+    def expire(self, tick):
+        # finalize the groups of sensors which stopped sending while others still do,
+        # finalized groups are kept until then to ignore their remaining repetitions
+        expired = [key for key, group in self.groups.items()
+                   if ticks_diff(tick, group.last_tick) > self.group_timeout]
+        for key in expired:
+            group = self.groups.pop(key)
+            if not group.closed:
+                self.finalize(group)
+
+    def receive(self, payload):
+        # a packed edge is a timestamp and a level of 4 bytes each
+        metrics.edges.inc(len(payload) // 8)
+        for item in EdgeBuffer.unpack(payload):
+            self.decode(item)
+
     def decode(self, item):
         timestamp, level = item
 
         # check if distance to previous group is bigger than
         # predefined timeout (offset). We assume we now have a
         # valid signal to save and will create a new group afterwards
-        if timestamp > (self.__distance + self.part_timeout):
-            if self.validate(self.group):
-                self.save(self.group)
-                self.out(self.group)
-
-            # create a new group (reset)
-            self.group = SignalGroup()
+        if ticks_diff(timestamp, self.__distance) > self.part_timeout:
+            self.close()
 
         duration, level = self.normalize(timestamp, level)
 
+        # the edge doesn't match any pulse-length, which
+        # breaks the current part (it can't be valid anymore)
+        if duration is None:
+            metrics.rejected_edges.inc()
+            self.route(timestamp)
+            return
+
         # indicating the end of the current part
         # and a possible beginning of a new part
-        if duration >= 750:
-            # this will be called multiple times, but we prevent
-            # adding multiple empty parts in SignalGroup class
-            self.group.add()
+        if duration in self.syncs:
+            # this will be called multiple times, empty parts are ignored
+            self.route(timestamp)
 
         # indicating a valid signal
-        if duration == 500:
-            self.group.append(level)
+        elif duration in self.bits:
+            self.part.append(level)
 
     def validate(self, group):
         if not group.valid:
             return False
 
-        if not self.last_measurement:
-            self.last_measurement = group
-
-        if not (self.last_measurement.temperature - 10) < group.temperature < (self.last_measurement.temperature + 10):
-            logging.debug(" Temperature out of range! Current: " + str(group.temperature) + " Last: " + str(self.last_measurement.temperature) + " (Tolerance: +/- 10 Degree)")
+        last_measurement = self.last_measurements.get(group.sensor, group)
+        if not (last_measurement.temperature - 10) < group.temperature < (last_measurement.temperature + 10):
+            logging.debug(" Temperature out of range! Current: %s Last: %s (Tolerance: +/- 10 Degree)",
+                          group.temperature, last_measurement.temperature)
+            group.reject("temperature_jump")
             return False
         return True
 
     def normalize(self, timestamp, level):
-        calculated_duration = timestamp - self.__distance
-        normalized_duration = self.pulse_length[min(range(len(self.pulse_length)),
-                                                key=lambda j: abs(self.pulse_length[j] - calculated_duration))]
+        calculated_duration = ticks_diff(timestamp, self.__distance)
+        normalized_duration = self.quantizer.quantize(calculated_duration)
 
         self.__distance = timestamp
         return [normalized_duration, level]
 
     def save(self, group):
-        self.__db.add_measurement(
+        self.__writer.put(
             group.station,
-            group.datestring,
+            group.timestamp,
             group.temperature,
             group.humidity,
-            group.bitstring
+            group.frame
         )
 
     def out(self, group):
+        if not self.output:
+            return
+
         print("-" * 80)
         print("Temperature Recording: Station " + group.station + " @ " + group.datestring)
         print("-" * 80)
-        print("Signal Descrip: " + "Ch   00 ID ?? B  Temperature    Humidity  00 ??")
-        print("Signal Encoded: " + group.bitstring_nice)
+        print("Signal Protocol: " + group.protocol.name)
+        print("Signal Encoded:  " + group.bitstring_nice)
         print(" ")
         print("Signal Decoded:")
-        print("Channel:\t\t" + str(group.channel))
-        print("Station:\t\t" + group.station)
-        print("Battery:\t\t" + group.battery)
-        print("Temperature:\t\t" + str(group.temperature) + "°C")
-        print("Humidity:\t\t" + str(group.humidity) + "%")
+        for name, value in group.values.items():
+            print(name.capitalize() + ":\t\t" + str(value) + UNITS.get(name, ""))
         print("-" * 80)
 
 
 class SignalPart:
+    # The bits of a part are shifted into a single int as they arrive,
+    # the first received bit ends up as the most significant one
+    __slots__ = ("_frame", "_length", "_validated", "_protocol")
+
     def __init__(self):
-        self._bits = []
-        self._validated = False
+        self._frame = 0
+        self._length = 0
+        self._validated = None
+        self._protocol = None
 
     def append(self, bit: int):
-        self._bits.append(bit)
+        self._frame = (self._frame << 1) | bit
+        self._length += 1
+        self._validated = None
 
     def delete(self, position: int):
-        del self._bits[position]
+        if position < 0:
+            position += self._length
+        shift = self._length - 1 - position
+        self._frame = ((self._frame >> (shift + 1)) << shift) | (self._frame & ((1 << shift) - 1))
+        self._length -= 1
+        self._validated = None
 
     def validate(self):
-        # A valid signal consists of 36 bits. Return false if
-        # we don't have exactly 36 bits to filter out erroneous signals
-        if len(self._bits) == 36:
-            self._validated = True
-        else:
-            self._validated = False
+        # A valid signal has the length and preamble of a known protocol.
+        # Return false otherwise to filter out erroneous signals
+        self._protocol = protocols.registry.match(self._length, self._frame)
+        self._validated = self._protocol is not None
         return self._validated
 
     @property
     def valid(self):
-        return self.validate()
+        # validated once, until the bits change again
+        if self._validated is None:
+            return self.validate()
+        return self._validated
+
+    @property
+    def frame(self):
+        return self._frame
+
+    @property
+    def protocol(self):
+        # protocol of a valid part, None otherwise
+        if self.valid:
+            return self._protocol
+        return None
 
     @property
     def bits(self):
-        return self._bits
+        return [(self._frame >> i) & 1 for i in range(self._length - 1, -1, -1)]
 
     def __len__(self):
-        return len(self._bits)
+        return self._length
 
 
 class SignalGroup:
     def __init__(self):
-        self._signal = []
         self._parts = []
-        self._validated = False
-        self._timestamp = datetime.now().timestamp()
+        self._validated = None
+        self._closed = False
+        self._tick = None
+        self._last_tick = None
+        self._timestamp = None
+        self._protocol = None
+
+        # why the group has been rejected by validate(), for the metrics
+        self._rejection = None
+
+        # a transmission is repeated several times, we need at least
+        # this many identical frames to trust the decoded signal
+        self.quorum = 3
+
+        # votes of the completed parts, counted by frame
+        self._votes = Counter()
+        self._leader_votes = 0
 
         # computed attributes
-        self.__bitstring = None
-        self.__bitstring_nice = None
+        self.__frame = None
+        self.__votes = 0
+        self.__confidence = 0
         self.__channel = None
         self.__battery = None
         self.__station = None
         self.__temperature = None
         self.__humidity = None
-        self.__datestring = None
+        self.__values = {}
 
         # add initial part
         self._parts.append(SignalPart())
 
-    def add(self):
-        # prevent adding a new part if the last part is empty
-        if len(self._parts[len(self._parts) - 1]) != 0:
-            part = SignalPart()
-            self._parts.append(part)
+    def add(self, tick=None):
+        # prevent adding a new part if the last part is empty. Returns
+        # True if the last part has been completed by this call (at tick)
+        part = self._parts[len(self._parts) - 1]
+        if self._closed or len(part) == 0:
+            return False
+
+        self.count(part, tick)
+        self._parts.append(SignalPart())
+        self._validated = None
+        return True
+
+    def insert(self, part, tick=None):
+        # add a part completed outside of the group (see SignalDecoder.route),
+        # in front of the open last part. Returns True unless the group is closed
+        if self._closed:
+            # the sensor is still repeating a finalized transmission,
+            # which keeps the group from expiring
+            if part.valid:
+                self._last_tick = tick
+            return False
+
+        self._parts.insert(len(self._parts) - 1, part)
+        self.count(part, tick)
+        self._validated = None
+        return True
+
+    def count(self, part, tick):
+        # vote for the frame of a completed part
+        if part.valid:
+            if self._tick is None:
+                self._tick = tick
+                self._protocol = part.protocol
+            self._last_tick = tick
+            self._votes[part.frame] += 1
+            self._leader_votes = max(self._leader_votes, self._votes[part.frame])
 
     def append(self, level):
-        self._parts[len(self._parts) - 1].append(level)
+        if not self._closed:
+            self._parts[len(self._parts) - 1].append(level)
+            self._validated = None
 
     def delete(self, position: int):
         del self._parts[position]
+        self._validated = None
 
-    def validate(self):
-        parts_list = []
-        for i, part in enumerate(self._parts):
-            # A valid signal consists of 36 bits. Skip parts that
-            # don't have exactly 36 bits to filter them out
-            if part.valid:
-                parts_list.append(part.bits)
+        # recount the votes of the remaining completed parts
+        self._votes = Counter(part.frame for part in self._parts[:-1] if part.valid)
+        self._leader_votes = max(self._votes.values(), default=0)
 
-        logging.debug(" SignalGroup holding " + str(len(self._parts)) + " part(s), of which " + str(len(parts_list)) + " are valid")
+    def close(self):
+        # ignore the remaining parts of an already finalized transmission
+        self._closed = True
 
-        # group signals by occurrence to hopefully find the correct
-        # signal, as we don't know how to compute the FCS (yet)
-        signal = [list(i) for j, i in itertools.groupby(sorted(parts_list))]
+    def tally(self):
+        # votes of all valid parts, including the last (maybe still open) part
+        votes = self._votes
+        part = self._parts[len(self._parts) - 1]
+        if part.valid:
+            votes = votes.copy()
+            votes[part.frame] += 1
+        return votes
 
-        if signal:
-            self._signal = max(signal, key=len)
-            self.compute(self._signal[0])
+    def validate(self):
+        # Parts that don't match a known protocol are not counted as votes
+        votes = self.tally()
+        valid_parts = sum(votes.values())
+
+        logging.debug(" SignalGroup holding %s part(s), of which %s are valid", len(self._parts), valid_parts)
+        self._rejection = None
+
+        # pick the signal with the most occurrences to hopefully find
+        # the correct one, as we don't know how to compute the FCS (yet)
+        if votes:
+            frame, count = votes.most_common(1)[0]
+            self.__votes = count
+            self.__confidence = count / valid_parts
+            self.compute(frame)
 
-            if len(signal[0]) < 3:
-                logging.debug(" Got " + str(len(signal[0])) + " valid SignalParts, but we need at least 3! Skipping...")
+            logging.debug(" Picking Signal with most occurrences: %s occurrences", count)
 
-            logging.debug(" Picking Signal with most occurrences: " + str(len(signal[0])) + " occurrences")
+            if count < self.quorum:
+                logging.debug(" Got %s valid SignalParts, but we need at least %s! Skipping...", count, self.quorum)
+                self.reject("below_quorum")
+                return False
 
             if self.check_values():
                 self._validated = True
                 return True
 
+            self._validated = False
+            return False
+
+        self.reject("no_valid_parts")
         return False
 
+    def reject(self, reason):
+        self._validated = False
+        self._rejection = reason
+
     def check_values(self):
         # Check the computed values if they seem valid
-        if self.__station == "Undefined":
-            print("Bad Station Name")
+        if self.__station in (None, "Undefined") or len(self.__station) > STATION_LENGTH:
+            logging.debug(" Bad Station Name")
+            self.reject("bad_station")
             return False
         if self.__battery == "Undefined":
-            print("Bad Battery Status")
+            logging.debug(" Bad Battery Status")
+            self.reject("bad_battery")
             return False
-        if not -20 < self.__temperature < 50:
-            print("Bad Temperature (out of valid range)")
+        low, high = self.protocol.temperature_range
+        if self.__temperature is None or not low < self.__temperature < high:
+            logging.debug(" Bad Temperature (out of valid range)")
+            self.reject("temperature_range")
             return False
         return True
 
-    def compute(self, signal):
-
-        # get the corresponding bits
-        _bitstring = "".join(map(str, signal))
-        _bitparts = [
-            _bitstring[0:4],
-            _bitstring[4:6],
-            _bitstring[6:8],
-            _bitstring[8:10],
-            _bitstring[10:12],
-            _bitstring[12:16],
-            _bitstring[16:20],
-            _bitstring[20:24],
-            _bitstring[24:28],
-            _bitstring[28:32],
-            _bitstring[32:34],
-            _bitstring[34:36]
-        ]
+    def compute(self, frame):
+        # the decoded values are kept until another frame wins the vote
+        if frame == self.__frame:
+            return
 
-        # Bitstring with visual separation
-        bitstring_separated = " ".join(_bitparts)
-
-        # Station
-        station = _bitstring[6:8]
-        if station == "00":
-            station = "T1"
-        elif station == "01":
-            station = "T2"
-        else:
-            station = "Undefined"
-
-        # Battery
-        battery = _bitstring[10:12]
-        if battery == "10":
-            battery = "OK"
-        elif battery == "01":
-            battery = "Low"
-        else:
-            battery = "Undefined"
-
-        # Channel
-        channel = BitArray(bin=_bitstring[0:4])
-        channel = channel.uint
-
-        # Temperature
-        temperature = BitArray(bin=_bitstring[13:24])
-        temperature.invert()
-        temperature = (temperature.uint - 500) / 10
-
-        # Humidity
-        humidity = BitArray(bin=_bitstring[25:32])
-        humidity.invert()
-        humidity = (humidity.uint / 2)
-
-        # Datetime string
-        datetime_ms = datetime.fromtimestamp(self._timestamp)
-        datetime_str = datetime_ms.strftime("%d/%m/%Y, %H:%M:%S")
-
-        self.__bitstring = _bitstring
-        self.__bitstring_nice = bitstring_separated
-        self.__temperature = temperature
-        self.__humidity = humidity
-        self.__channel = channel
-        self.__battery = battery
-        self.__station = station
-        self.__datestring = datetime_str
+        # fields the protocol doesn't have are left empty
+        values = self.protocol.decode(frame)
+
+        self.__frame = frame
+        self.__values = values
+        self.__temperature = values.get("temperature")
+        self.__humidity = values.get("humidity")
+        self.__channel = values.get("channel")
+        self.__battery = values.get("battery")
+        self.__station = values.get("station")
 
     def __len__(self):
         return len(self._parts)
 
     @property
     def valid(self):
-        return self.validate()
+        # validated once, until parts are appended, added or deleted
+        if self._validated is None:
+            return self.validate()
+        return self._validated
+
+    @property
+    def parts(self):
+        return self._parts
+
+    @property
+    def complete(self):
+        # enough identical frames have been received to finalize the group
+        return self._leader_votes >= self.quorum
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def protocol(self):
+        # protocol of the first valid part, frames computed without
+        # their parts are taken as frames of the default protocol
+        return self._protocol or protocols.registry.default
+
+    @property
+    def rejection(self):
+        return self._rejection
+
+    @property
+    def last_tick(self):
+        # tick of the last valid part
+        return self._last_tick
+
+    @property
+    def votes(self):
+        return self.__votes
+
+    @property
+    def confidence(self):
+        return self.__confidence
 
     @property
     def timestamp(self):
+        # time of the first valid part, converted from its edge tick
+        if self._timestamp is None and self._tick is not None:
+            self._timestamp = ticks_datetime(self._tick)
         return self._timestamp
 
+    @property
+    def frame(self):
+        return self.__frame
+
     @property
     def bitstring(self):
-        return self.__bitstring
+        if self.__frame is None:
+            return None
+        return format(self.__frame, "0" + str(self.protocol.frame_length) + "b")
 
     @property
     def bitstring_nice(self):
-        return self.__bitstring_nice
+        # Bitstring with visual separation
+        bitstring = self.bitstring
+        if bitstring is None:
+            return None
+        layout = self.protocol.layout
+        return " ".join(bitstring[start:end] for start, end in zip(layout, layout[1:]))
+
+    @property
+    def sensor(self):
+        # protocol and leading bits identifying the sensor of the frame
+        if self.__frame is None:
+            return None
+        return self.protocol, self.protocol.key(self.__frame)
+
+    @property
+    def values(self):
+        # all decoded fields of the protocol by name
+        return self.__values
 
     @property
     def channel(self):
@@ -350,4 +608,7 @@ class SignalGroup:
 
     @property
     def datestring(self):
-        return self.__datestring
+        # local time, for display only
+        if self.timestamp is None:
+            return None
+        return self.timestamp.astimezone().strftime("%d/%m/%Y, %H:%M:%S")
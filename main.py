@@ -5,11 +5,12 @@ import signal
 import time
 import RPi.GPIO as GPIO
 import argparse
+import metrics
 from multiprocessing import Process, Queue
 from decoder import SignalDecoder
 from database import DatabaseConnector
+from transport import EdgeBuffer, ticks_us
 from restapi import run_server
-from datetime import datetime
 from multiprocessing import active_children
 
 
@@ -70,8 +71,8 @@ def get_ip_address(ifname):
 def callback(channel):
     # Callback for GPIO event detection
     level = GPIO.input(channel)
-    timestamp = datetime.now().microsecond
-    decoder_queue.put([timestamp, level])
+    timestamp = ticks_us()
+    edge_buffer.append(timestamp, level)
 
 
 def setup_callback(cb):
@@ -80,15 +81,26 @@ def setup_callback(cb):
     GPIO.add_event_detect(GPIO_PIN, GPIO.BOTH, callback=cb)
 
 
+def run_decoder(qq, dba, values):
+    # the metrics live in the memory of the main process
+    metrics.registry.attach(values)
+    SignalDecoder(qq, dba)
+
+
+def run_restapi(values):
+    metrics.registry.attach(values)
+    run_server()
+
+
 def start_decoder(qq, dba):
-    process = Process(target=SignalDecoder, args=(qq, dba))
+    process = Process(target=run_decoder, args=(qq, dba, metrics.registry.values))
     process.daemon = False
     process.start()
     return process
 
 
 def start_restapi():
-    process = Process(target=run_server)
+    process = Process(target=run_restapi, args=(metrics.registry.values,))
     process.daemon = False
     process.start()
     return process
@@ -104,6 +116,8 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, exit_handler)
 
     decoder_queue = Queue()
+    edge_buffer = EdgeBuffer(decoder_queue)
+    edge_buffer.start()
     db = DatabaseConnector()
     setup_callback(callback)
 
@@ -0,0 +1,135 @@
+from bisect import bisect_left
+from multiprocessing import RawArray
+
+# Counters, gauges and histograms kept in shared memory. The values are allocated
+# when this module is imported by the main process and handed to the decoder and
+# API processes (Registry.attach), so they update and read the same memory with
+# every start method. Every metric is written by a single process only, an update
+# is a plain float operation without locks
+
+
+class Registry:
+
+    def __init__(self, size=512):
+        self.values = RawArray('d', size)
+        self.metrics = []
+        self.__next = 0
+
+    def allocate(self, count):
+        if self.__next + count > len(self.values):
+            raise MemoryError("Metrics registry is full")
+        slot = self.__next
+        self.__next += count
+        return slot
+
+    def attach(self, values):
+        # use the values of another process (its registry.values), the metrics
+        # are defined in the same order by every process importing this module
+        self.values = values
+        for metric in self.metrics:
+            metric.values = values
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP " + metric.name + " " + metric.help)
+            lines.append("# TYPE " + metric.name + " " + metric.type)
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def labels(label, value):
+    if label is None:
+        return ""
+    return "{" + label + "=\"" + value + "\"}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, label=None, values=("",), registry=registry):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = registry.values
+
+        # one slot per label value
+        slot = registry.allocate(len(values))
+        self.slots = {value: slot + i for i, value in enumerate(values)}
+        self.slot = self.slots[values[0]]
+        registry.register(self)
+
+    def inc(self, amount=1, value=None):
+        self.values[self.slot if value is None else self.slots[value]] += amount
+
+    def get(self, value=None):
+        return self.values[self.slot if value is None else self.slots[value]]
+
+    def expose(self):
+        return [self.name + labels(self.label, value) + " " + repr(self.values[slot])
+                for value, slot in self.slots.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, amount, value=None):
+        self.values[self.slot if value is None else self.slots[value]] = amount
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, registry=registry):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.values = registry.values
+
+        # a slot per bucket and +Inf, followed by sum and count
+        self.slot = registry.allocate(len(self.buckets) + 3)
+        self.sum_slot = self.slot + len(self.buckets) + 1
+        registry.register(self)
+
+    def observe(self, amount):
+        self.values[self.slot + bisect_left(self.buckets, amount)] += 1
+        self.values[self.sum_slot] += amount
+        self.values[self.sum_slot + 1] += 1
+
+    def expose(self):
+        lines = []
+        total = 0
+        for i, bucket in enumerate(self.buckets + ["+Inf"]):
+            total += self.values[self.slot + i]
+            lines.append(self.name + "_bucket{le=\"" + str(bucket) + "\"} " + repr(total))
+        lines.append(self.name + "_sum " + repr(self.values[self.sum_slot]))
+        lines.append(self.name + "_count " + repr(self.values[self.sum_slot + 1]))
+        return lines
+
+
+# decoder process
+queue_depth = Gauge("decoder_queue_depth", "Edge batches waiting in the decoder queue")
+edges = Counter("decoder_edges_total", "Edges received by the decoder")
+rejected_edges = Counter("decoder_rejected_edges_total", "Edges not matching any pulse-length")
+groups = Counter("decoder_groups_total", "Finalized signal groups by result", label="result",
+                 values=("saved", "no_valid_parts", "below_quorum", "bad_station", "bad_battery",
+                         "temperature_range", "temperature_jump"))
+parts_per_group = Histogram("decoder_parts_per_group", "Parts received per signal group",
+                            buckets=(1, 2, 4, 6, 8, 12, 16, 32))
+decode_latency = Histogram("decoder_latency_seconds", "Time from the last part of a group until it's saved",
+                           buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+
+# measurement writer (decoder process)
+write_latency = Histogram("database_write_seconds", "Duration of a batch insert",
+                          buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+rows = Counter("database_rows_total", "Measurements written to the database")
+write_errors = Counter("database_write_errors_total", "Failed batch inserts")
+backlog = Gauge("database_backlog", "Measurements waiting to be written")
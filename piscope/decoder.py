@@ -1,4 +1,10 @@
 import logging
+from quantizer import Quantizer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ID1  ->    ID 1
 # CH   ->    Channel
@@ -18,26 +24,31 @@ import logging
 
 
 class Decoder:
+    # The stages are generators, the capture is decoded while it's read
+    # and only the current chunk is kept in memory
 
     def __init__(self, file=None):
         self.timedelta = [0, 250, 500, 750, 1000]
+        self.quantizer = Quantizer(self.timedelta, tolerance=100)
         self.level_low = "1000C1FF"
         self.level_high = "1080C1FF"
 
-        self.raw_content = None
-        self.raw_parts = []
+        # size of the read buffer (bytes)
+        self.buffer_size = 1 << 20
 
-        self.parts = []
-        self.chunks = []
         self.signal = []
 
+        # number of edges and tick of the last edge of the last batch decoded capture
+        self.edges = 0
+        self.last_tick = None
+
         if file:
             self.decode(file)
 
     def read_from_file(self, file):
         try:
-            with open(file) as f_obj:
-                lines = f_obj.readlines()
+            with open(file, buffering=self.buffer_size) as f_obj:
+                yield from f_obj
         except FileNotFoundError:
             logging.error("Sorry, the file " + file + " does not exist.")
         except IsADirectoryError:
@@ -47,38 +58,35 @@ class Decoder:
         except IOError:
             logging.error("Sorry, the file " + file + " cant be opened because of an IOError.")
 
-        self.raw_content = lines
-
-    def extract(self):
+    def extract(self, lines):
         offset = None
 
-        for line in self.raw_content:
+        for line in lines:
             # Skipping comments
             if not line.startswith('#'):
+                # left: time / right: level
+                time, level = line.split()
+                time = int(time)
+
                 # get initial time offset
                 if offset is None:
-                    offset = line.split()[0]
+                    offset = time
 
-                # strip newline character
-                stripped_line = line.strip()
+                yield time - offset, level
 
-                # left: time / right: level
-                time, level = stripped_line.split()
-                self.raw_parts.append([int(time) - int(offset), level])
+    def normalize(self, raw_parts):
+        distance = 0
 
-    def normalize(self):
-        items = self.raw_parts
-        for i, item in enumerate(items):
-            time = item[0]
-            level = item[1]
+        for time, level in raw_parts:
+            calculated_time = time - distance
+            distance = time
 
-            distance = 0
-            if i > 0:
-                distance = int(items[i - 1][0])
+            normalized_time = self.quantizer.quantize(calculated_time)
 
-            calculated_time = time - distance
-            normalized_time = self.timedelta[min(range(len(self.timedelta)),
-                                                 key=lambda j: abs(self.timedelta[j]-calculated_time))]
+            # edges which don't match any pulse-length split the signal
+            if normalized_time is None:
+                logging.debug("Rejected edge with a duration of %d us", calculated_time)
+                normalized_time = self.timedelta[-1]
 
             if level == self.level_low:
                 normalized_level = 0
@@ -87,36 +95,69 @@ class Decoder:
             else:
                 raise EncodingWarning('The provided level seems to be malformed!')
 
-            self.parts.append([normalized_time, normalized_level])
+            yield normalized_time, normalized_level
 
-    def split(self):
+    def split(self, parts):
         split_part = []
 
-        for part in self.parts:
+        for part in parts:
             time = part[0]
 
             if time < 750:
                 split_part.append(part)
             else:
-                self.chunks.append(split_part)
-                split_part.clear()
+                yield split_part
+                split_part = []
 
-    def filter(self):
-        for chunk in self.chunks:
-            signal = []
-            for part in chunk:
-                time = part[0]
-                level = part[1]
+        if split_part:
+            yield split_part
 
-                if time >= 500:
-                    signal.append(level)
-            self.signal.append(signal)
+    def filter(self, chunks):
+        for chunk in chunks:
+            yield [level for time, level in chunk if time >= 500]
 
-    def decode(self, file):
-        self.read_from_file(file)
-        self.extract()
-        self.normalize()
-        self.split()
-        self.filter()
+    def decode_batch(self, file, length=36):
+        # Decode a whole capture with NumPy, without per-sample Python code.
+        # Returns the frames with exactly length bits (as ints) and the tick
+        # of the last bit of every frame
+        if np is None:
+            raise ImportError("numpy is required to decode captures in batch mode")
+
+        capture = np.loadtxt(file, dtype=[("tick", np.int64), ("level", "U8")], comments="#", ndmin=1)
+        ticks = capture["tick"]
+        levels = capture["level"] == self.level_high
 
+        self.edges = len(ticks)
+        self.last_tick = int(ticks[-1]) if len(ticks) else None
+
+        if not (levels | (capture["level"] == self.level_low)).all():
+            raise EncodingWarning('The provided level seems to be malformed!')
+
+        # durations between the edges (the ticks are unsigned 32 bit and may wrap)
+        durations = np.diff(ticks, prepend=ticks[:1]) % (1 << 32)
+        durations = self.quantizer.quantize_array(durations)
+
+        # rejected edges split the signal, like gaps do
+        split = (durations >= 750) | (durations < 0)
+        chunk = np.cumsum(split)
+        bit = (durations >= 500) & ~split
+
+        # keep the bits of the chunks with exactly length bits
+        bit_chunk = chunk[bit]
+        valid = np.bincount(bit_chunk, minlength=chunk[-1] + 1 if len(chunk) else 1) == length
+        selected = valid[bit_chunk]
+
+        bits = levels[bit][selected].reshape(-1, length).astype(np.uint64)
+        weights = np.uint64(1) << np.arange(length - 1, -1, -1, dtype=np.uint64)
+        frames = (bits * weights).sum(axis=1, dtype=np.uint64)
+        frame_ticks = ticks[bit][selected].reshape(-1, length)[:, -1]
+
+        return frames, frame_ticks
+
+    def iter_decode(self, file):
+        # yields the signal (list of bits) of every chunk in file
+        return self.filter(self.split(self.normalize(self.extract(self.read_from_file(file)))))
+
+    def decode(self, file):
+        self.signal = list(self.iter_decode(file))
         return self.signal
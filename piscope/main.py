@@ -1,22 +1,145 @@
-from pprint import pprint
+import os
+import csv
+import sys
+import glob
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from piscope.decoder import Decoder
+from decoder import SignalGroup
+
+
+def find_captures(paths):
+    # files, directories (all files within) and glob patterns
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            captures += sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if os.path.isfile(os.path.join(path, name)))
+        else:
+            captures += sorted(glob.glob(path)) or [path]
+    return captures
+
+
+def decode_capture(path):
+    # Runs in a worker process. The piscope ticks are relative, so they are
+    # anchored on the modification time of the file (the time of its last edge)
+    decoder = Decoder()
+    start = time.perf_counter()
+    frames, ticks = decoder.decode_batch(path)
+    duration = time.perf_counter() - start
+
+    end = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+    readings = []
+    for frame, tick in zip(frames.tolist(), ticks.tolist()):
+        age = (decoder.last_tick - tick) % (1 << 32)
+        readings.append((end - timedelta(microseconds=age), frame))
+
+    return path, decoder.edges, duration, readings
+
+
+def deduplicate(readings, window, quorum=1):
+    # A transmission repeats its frame several times (and captures may overlap).
+    # Occurrences of a frame less than window seconds apart are one transmission,
+    # which is kept at its first occurrence if it was received at least quorum times
+    transmissions = {}
+    result = []
+    for timestamp, frame in sorted(readings):
+        transmission = transmissions.get(frame)
+        if transmission is None or (timestamp - transmission[1]).total_seconds() > window:
+            if transmission and transmission[2] >= quorum:
+                result.append((transmission[0], frame))
+            transmission = transmissions[frame] = [timestamp, timestamp, 0]
+        transmission[1] = timestamp
+        transmission[2] += 1
+
+    result += [(first, frame) for frame, (first, last, count) in transmissions.items() if count >= quorum]
+    return sorted(result)
+
+
+def measurements(readings):
+    # (station, timestamp, temperature, humidity, raw) of every valid reading
+    group = SignalGroup()
+    for timestamp, frame in readings:
+        group.compute(frame)
+        if group.check_values():
+            yield group.station, timestamp, group.temperature, group.humidity, frame
+
+
+def write_csv(rows, output):
+    writer = csv.writer(output)
+    writer.writerow(["station", "timestamp", "temperature", "humidity", "raw"])
+    for station, timestamp, temperature, humidity, raw in rows:
+        writer.writerow([station, timestamp.isoformat(), temperature, humidity, format(raw, "036b")])
+
+
+def write_json(rows, output):
+    json.dump([{"station": station,
+                "timestamp": timestamp.isoformat(),
+                "temperature": temperature,
+                "humidity": humidity,
+                "raw": format(raw, "036b")} for station, timestamp, temperature, humidity, raw in rows], output, indent=2)
+
+
+def write_database(rows, batch_size=1000):
+    from database import DatabaseConnector
+
+    db = DatabaseConnector()
+    db.connect()
+    db.setup()
+    for i in range(0, len(rows), batch_size):
+        db.add_measurements(rows[i:i + batch_size])
+    db.disconnect()
 
 
-# Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    print("This is a simple decoder for raw piscope data captured from a 433Mhz-Thermometer")
-    # filepath = input("Please enter the filepath for the raw data: ")
-    filepath = "raw_dump"
-
-    raw_decoder = Decoder()
-    result = raw_decoder.decode(filepath)
-
-    print("Decoded result:")
-    # print(result)
-    raw_signals = []
-    for signal in result:
-        string = ""
-        for chunk in signal:
-            string += str(chunk)
-        raw_signals.append(string)
-    pprint(raw_signals)
+    print("This is a simple decoder for raw piscope data captured from a 433Mhz-Thermometer", file=sys.stderr)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="*", default=[os.path.join(os.path.dirname(__file__), "raw_dump")],
+                        help="Capture files, directories or glob patterns")
+    parser.add_argument("-f", "--format", choices=["csv", "json", "db"], default="csv", help="Output format")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("-d", "--window", type=float, default=5, help="Seconds in which a repeated frame is a duplicate")
+    parser.add_argument("-q", "--quorum", type=int, default=SignalGroup().quorum,
+                        help="Repetitions of a frame needed within the window, like the live decoder")
+    args = parser.parse_args()
+
+    readings = []
+    failed = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(decode_capture, path): path for path in find_captures(args.captures)}
+        for future in as_completed(futures):
+            try:
+                path, edges, duration, frames = future.result()
+            except Exception as er:
+                # a missing or malformed capture doesn't abort the others
+                failed.append(futures[future])
+                print(futures[future] + ": " + type(er).__name__ + ": " + str(er), file=sys.stderr)
+                continue
+            readings += frames
+            print(path + ": " + str(edges) + " edges, " + str(len(frames)) + " frames, "
+                  + str(int(edges / duration) if duration else 0) + " edges/s", file=sys.stderr)
+
+    if failed:
+        print(str(len(failed)) + " capture(s) couldn't be decoded", file=sys.stderr)
+
+    rows = list(measurements(deduplicate(readings, args.window, args.quorum)))
+    print(str(len(rows)) + " measurement(s) in " + str(round(time.perf_counter() - started, 2)) + " s", file=sys.stderr)
+
+    if args.format == "db":
+        write_database(rows)
+    else:
+        output = open(args.output, "w", newline="") if args.output else sys.stdout
+        with output:
+            if args.format == "csv":
+                write_csv(rows, output)
+            else:
+                write_json(rows, output)
+
+    if failed:
+        sys.exit(1)
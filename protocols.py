@@ -0,0 +1,181 @@
+from quantizer import Quantizer
+
+# Sensor families (protocols) known to the decoder. Every protocol is pulse-width
+# encoded the same way: pulses of the bit class carry a bit (the level after the
+# pulse), pulses of the sync class (or longer) end a part, other classes are ignored.
+# Protocols differ in their pulse-lengths, frame length, preamble and fields
+
+
+class Protocol:
+
+    def __init__(self, name, pulse_length, bit, sync, frame_length, fields, tolerance=100,
+                 preamble=0, preamble_length=0, key_length=0, layout=None, temperature_range=(-20, 50)):
+        self.name = name
+
+        # predefined pulse-length classes (µs) and their accepted deviation,
+        # either one value or one per class
+        if isinstance(tolerance, int):
+            tolerance = [tolerance] * len(pulse_length)
+        classes = sorted(zip(pulse_length, tolerance))
+        self.pulse_length = [length for length, _ in classes]
+        self.tolerance = [deviation for _, deviation in classes]
+
+        # pulse-length carrying a bit, and the pulse-length ending a part
+        self.bit = bit
+        self.sync = sync
+
+        # number of bits in a frame, and the leading bits every frame starts with.
+        # Frames are stored as BIGINT, so they can't be longer than 63 bits
+        if not 0 < frame_length <= 63:
+            raise ValueError("The frame length of " + name + " must be between 1 and 63 bits")
+        self.frame_length = frame_length
+        self.preamble = preamble
+        self.preamble_length = preamble_length
+
+        # number of leading bits identifying the sensor, parts of
+        # different sensors are voted on separately
+        self.key_length = key_length
+
+        # name -> (start, end, convert) of the bits [start:end] of a frame.
+        # Measurements are stored by station, every protocol needs to name it
+        if "station" not in fields:
+            raise ValueError(name + " has no station field")
+        self.fields = fields
+
+        # bit offsets separating the frame for display
+        self.layout = layout or [0, frame_length]
+
+        # plausible temperatures (exclusive)
+        self.temperature_range = temperature_range
+
+    def roles(self):
+        # pulse-length -> (role, tolerance)
+        return {length: ("bit" if length == self.bit else "sync" if length == self.sync else None, tolerance)
+                for length, tolerance in zip(self.pulse_length, self.tolerance)}
+
+    def field(self, frame, start, end):
+        # read the bits [start:end] of a frame as unsigned int
+        return (frame >> (self.frame_length - end)) & ((1 << (end - start)) - 1)
+
+    def key(self, frame):
+        return frame >> (self.frame_length - self.key_length)
+
+    def decode(self, frame):
+        return {name: convert(self.field(frame, start, end)) for name, (start, end, convert) in self.fields.items()}
+
+    def __repr__(self):
+        return "Protocol(" + self.name + ")"
+
+
+class ProtocolRegistry:
+    # Dispatches completed parts to their protocol. The pulse-lengths of all protocols
+    # are merged into one quantizer and parts are looked up by their length and
+    # preamble, so the cost per edge and per part doesn't grow with the protocols
+
+    def __init__(self):
+        self.protocols = []
+        self.quantizer = None
+        self.pulse_length = []
+
+        # pulse-lengths carrying a bit, and ending a part
+        self.bits = frozenset()
+        self.syncs = frozenset()
+
+        # frame length -> [(shift, {preamble: protocol}), ...], longest preamble first
+        self._index = {}
+
+    def register(self, protocol):
+        # the registry is left unchanged if the protocol conflicts with a registered one
+        protocols = self.protocols + [protocol]
+        roles = self._merge(protocols)
+        index = self._build_index(protocols)
+
+        classes = sorted(roles)
+        if roles[classes[-1]][0] != "sync":
+            raise ValueError("The longest pulse-length " + str(classes[-1]) + " must end a part, "
+                             "as every longer gap does")
+
+        self.protocols = protocols
+        self.pulse_length = classes
+        self.quantizer = Quantizer(classes, tolerance=[roles[length][1] for length in classes])
+        self.bits = frozenset(length for length in classes if roles[length][0] == "bit")
+        self.syncs = frozenset(length for length in classes if roles[length][0] == "sync")
+        self._index = index
+        return protocol
+
+    @staticmethod
+    def _merge(protocols):
+        roles = {}
+        for protocol in protocols:
+            for length, role in protocol.roles().items():
+                if roles.setdefault(length, role) != role:
+                    raise ValueError("Pulse-length " + str(length) + " of " + protocol.name +
+                                     " conflicts with another protocol")
+
+        # the tolerance windows of different classes must not overlap
+        classes = sorted(roles)
+        for shorter, longer in zip(classes, classes[1:]):
+            if shorter + roles[shorter][1] >= longer - roles[longer][1]:
+                raise ValueError("Pulse-lengths " + str(shorter) + " and " + str(longer) + " overlap")
+        return roles
+
+    @staticmethod
+    def _build_index(protocols):
+        preambles = {}
+        for protocol in protocols:
+            candidates = preambles.setdefault(protocol.frame_length, {}).setdefault(protocol.preamble_length, {})
+            if protocol.preamble in candidates:
+                raise ValueError(protocol.name + " can't be told apart from " + candidates[protocol.preamble].name)
+            candidates[protocol.preamble] = protocol
+
+        return {length: [(length - preamble_length, candidates[preamble_length])
+                         for preamble_length in sorted(candidates, reverse=True)]
+                for length, candidates in preambles.items()}
+
+    def match(self, length, frame):
+        # protocol of a part of length bits, None if there is none
+        for shift, candidates in self._index.get(length, ()):
+            protocol = candidates.get(frame >> shift)
+            if protocol is not None:
+                return protocol
+        return None
+
+    @property
+    def default(self):
+        # the protocol of frames decoded without their part (piscope captures)
+        return self.protocols[0]
+
+
+# ID1  ->    ID 1
+# CH   ->    Channel
+# ID2  ->    ID 2
+# V    ->    Voltage (Battery ok/nok)
+# TR   ->    Temperature Trend (00 – stable, 01 – increasing, 10 – decreasing)
+# B    ->    Battery changed
+# TEMP ->    Temperature (500 -> 00.000 Degree)
+# HUM  ->    Humidity
+# FCS  ->    Frame Check Sequence (XOR separate for temp and hum?)
+
+# ID1   CH  ID2 V  TR  B  TEMP            HUM        FCS
+# 0010  00  11  0  01  0  0001 1111 0100  1001 1111  1110   / -00 Grad (T2)  500 -> 00.000 Degree
+
+TEKO = Protocol(
+    "TEKO",
+    pulse_length=[0, 250, 500, 750],
+    bit=500,
+    sync=750,
+    frame_length=36,
+    key_length=8,
+    layout=[0, 4, 6, 8, 10, 12, 16, 20, 24, 28, 32, 34, 36],
+    fields={
+        "channel": (0, 4, int),
+        "station": (6, 8, lambda value: {0b00: "T1", 0b01: "T2"}.get(value, "Undefined")),
+        "battery": (10, 12, lambda value: {0b10: "OK", 0b01: "Low"}.get(value, "Undefined")),
+        # inverted
+        "temperature": (13, 24, lambda value: ((value ^ 0x7FF) - 500) / 10),
+        "humidity": (25, 32, lambda value: (value ^ 0x7F) / 2)
+    }
+)
+
+registry = ProtocolRegistry()
+registry.register(TEKO)
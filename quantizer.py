@@ -0,0 +1,57 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Quantizer:
+    # Maps measured pulse durations (µs) to the nearest predefined pulse-length
+    # class. The classes are looked up in a precomputed table, durations outside
+    # of every tolerance window are rejected (None, or -1 for arrays)
+
+    def __init__(self, pulse_length, tolerance=100, open_ended=True):
+        # predefined pulse-length classes and the accepted deviation
+        # from a class, either one value or one per class
+        if isinstance(tolerance, int):
+            tolerance = [tolerance] * len(pulse_length)
+        classes = sorted(zip(pulse_length, tolerance))
+        self.pulse_length = [length for length, _ in classes]
+        self.tolerance = [deviation for _, deviation in classes]
+
+        # durations beyond the longest class are mapped onto it (gaps)
+        self.open_ended = open_ended
+
+        self._size = self.pulse_length[-1] + self.tolerance[-1] + 1
+        self._table = [self._nearest(duration) for duration in range(self._size)]
+        self._overflow = self.pulse_length[-1] if open_ended else None
+
+    def _nearest(self, duration):
+        # ties go to the shorter class
+        index = min(range(len(self.pulse_length)), key=lambda j: abs(self.pulse_length[j] - duration))
+        if abs(self.pulse_length[index] - duration) > self.tolerance[index]:
+            if not (self.open_ended and duration >= self.pulse_length[-1]):
+                return None
+        return self.pulse_length[index]
+
+    def quantize(self, duration):
+        if duration < self._size:
+            return self._table[duration] if duration >= 0 else None
+        return self._overflow
+
+    def quantize_array(self, durations):
+        if np is None:
+            raise ImportError("numpy is required to quantize arrays of durations")
+
+        durations = np.asarray(durations, dtype=np.int64)
+        classes = np.asarray(self.pulse_length, dtype=np.int64)
+        tolerance = np.asarray(self.tolerance, dtype=np.int64)
+
+        # index of the nearest class, ties go to the shorter class
+        index = np.digitize(durations, (classes[1:] + classes[:-1]) / 2, right=True)
+        nearest = classes[index]
+
+        valid = (np.abs(durations - nearest) <= tolerance[index]) & (durations >= 0)
+        if self.open_ended:
+            valid |= durations >= classes[-1]
+
+        return np.where(valid, nearest, -1)
@@ -0,0 +1,169 @@
+import time
+import random
+import argparse
+from decoder import SignalDecoder
+from protocols import TEKO
+from transport import TICKS_MASK, ticks_us
+
+
+class MemoryStorage:
+    # In-memory replacement for DatabaseConnector, keeps the measurements in a list
+
+    def __init__(self):
+        self.measurements = []
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def setup(self):
+        pass
+
+    def maintain(self):
+        pass
+
+    def add_measurement(self, station, timestamp, temperature, humidity, raw):
+        self.measurements.append((station, timestamp, temperature, humidity, raw))
+
+    def add_measurements(self, measurements):
+        self.measurements += measurements
+
+    def get_measurement(self, limit=1):
+        return [(i,) + measurement for i, measurement in enumerate(self.measurements)][::-1][:limit]
+
+
+def read_capture(file, level_high="1080C1FF"):
+    # edges (tick, level) of a piscope capture
+    with open(file) as f_obj:
+        for line in f_obj:
+            if not line.startswith('#'):
+                tick, level = line.split()
+                yield int(tick) & TICKS_MASK, int(level == level_high)
+
+
+def encode_frame(station="T1", temperature=20.0, humidity=50.0, channel=9, battery="OK"):
+    # the frame a TEKO sensor sends for the reading, counterpart of SignalGroup.compute
+    fields = [
+        (channel, 4),
+        (0b01, 2),
+        ({"T1": 0b00, "T2": 0b01}[station], 2),
+        (0b00, 2),
+        ({"OK": 0b10, "Low": 0b01}[battery], 2),
+        (0b0, 1),
+        ((round(temperature * 10) + 500) ^ 0x7FF, 11),
+        (0b0, 1),
+        (round(humidity * 2) ^ 0x7F, 7),
+        (0b0000, 4)
+    ]
+
+    frame = 0
+    for value, length in fields:
+        frame = (frame << length) | (value & ((1 << length) - 1))
+    return frame
+
+
+def synthesize(frames, repeats=6, start=0, sync=4, gap=10000, jitter=0, drop=0, interleave=False, seed=None):
+    # Edges (tick, level) of a transmission of every frame. A part is made of
+    # sync pulses of 750 µs, followed by the bits: every bit is an edge after
+    # 500 µs with the level of the bit, preceded by a 250 µs pulse if needed.
+    # Pulses get +/- jitter µs, edges are lost with a probability of drop. With
+    # interleave all frames are transmitted at once, alternating their parts
+    rng = random.Random(seed)
+    tick = start
+    level = 0
+
+    def pulse(duration):
+        nonlocal tick, level
+        tick += duration + (rng.randint(-jitter, jitter) if jitter else 0)
+        level ^= 1
+        if drop and rng.random() < drop:
+            return []
+        return [(tick & TICKS_MASK, level)]
+
+    def part(frame):
+        edges = []
+        for _ in range(sync):
+            edges += pulse(750)
+
+        for position in range(TEKO.frame_length - 1, -1, -1):
+            bit = (frame >> position) & 1
+            if level ^ 1 != bit:
+                edges += pulse(250)
+            edges += pulse(500)
+        return edges
+
+    transmissions = [frames] if interleave else [[frame] for frame in frames]
+    for transmission in transmissions:
+        for _ in range(repeats):
+            for frame in transmission:
+                yield from part(frame)
+
+        tick += gap
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def replay(edges, realtime=False, decoder=None):
+    # Feed edges through SignalDecoder.decode, like the live decoder process does.
+    # The ticks are moved onto the local tick counter, so the decoder derives
+    # plausible timestamps. Returns the storage and the statistics of the run
+    storage = MemoryStorage()
+    if decoder is None:
+        decoder = SignalDecoder(None, storage, autostart=False)
+        decoder.output = False
+    decoder.open()
+
+    latencies = []
+    offset = None
+    started = time.perf_counter()
+    origin = ticks_us()
+
+    for tick, level in edges:
+        if offset is None:
+            offset = tick
+        delta = (tick - offset) & TICKS_MASK
+
+        if realtime:
+            wait = started + delta / 1000000 - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        before = time.perf_counter()
+        decoder.decode(((origin + delta) & TICKS_MASK, level))
+        latencies.append(time.perf_counter() - before)
+
+    decoder.shutdown()
+    duration = time.perf_counter() - started
+
+    frames = len(storage.measurements)
+    stats = {
+        "edges": len(latencies),
+        "frames": frames,
+        "seconds": duration,
+        "edges_per_second": len(latencies) / duration if duration else 0,
+        "frames_per_second": frames / duration if duration else 0,
+        "decode_p50_us": percentile(latencies, 50) * 1000000,
+        "decode_p99_us": percentile(latencies, 99) * 1000000
+    }
+    return storage, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a piscope capture through SignalDecoder, without GPIO")
+    parser.add_argument("capture", nargs="?", default="piscope/raw_dump", help="piscope capture file")
+    parser.add_argument("-r", "--realtime", action="store_true", help="Replay at the speed of the capture")
+    args = parser.parse_args()
+
+    storage, stats = replay(read_capture(args.capture), realtime=args.realtime)
+
+    for measurement in storage.measurements:
+        print(measurement)
+    for key, value in stats.items():
+        print(key + ": " + str(round(value, 2)))
@@ -1,77 +1,262 @@
-from flask import Flask, Response, jsonify, send_from_directory, url_for, redirect
+from flask import Flask, Response, send_from_directory, url_for, redirect, request
 from flask_restful import Resource, Api
 from flask.logging import default_handler
-from database import DatabaseConnector
+from database import DatabaseConnector, DatabaseError
+from cache import Measurement, MeasurementCache
+import metrics
 from gevent.pywsgi import WSGIServer
+from gevent.queue import Queue, Empty, Full
+from datetime import datetime, timedelta, timezone
+import gevent
 import logging
+import json
+import gzip
+import zlib
 
-db = DatabaseConnector()
-db.connect()
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# every request checks out its own connection from the pool
+db = DatabaseConnector(pool_size=8, green=True)
+
+# latest measurements, requests are answered from here while it's ready
+cache = MeasurementCache(stations=("T1", "T2"), size=30)
+
+# bucket sizes (seconds) offered for aggregated charts and the
+# maximum number of buckets returned per station
+RESOLUTIONS = [60, 300, 900, 3600, 3 * 3600, 6 * 3600, 86400, 7 * 86400]
+MAX_POINTS = 500
+
+# responses bigger than this (bytes) are compressed, if the client accepts gzip
+GZIP_MIN_SIZE = 512
+
+
+def latest_measurements(limit):
+    if cache.ready:
+        return cache.latest(limit)
+    return [Measurement._make(record[:5]) for record in db.get_measurement(limit=limit)]
+
+
+def station_measurements(station):
+    if cache.ready:
+        return cache.station(station)
+    return [Measurement._make(record) for record in reversed(db.get_latest_by_station(limit=cache.size, station=station))]
+
+
+def listen():
+    # keep the cache current with the notifications of the database and
+    # reload it whenever the listener had to (re)connect
+    while True:
+        try:
+            for payload in db.listen("measurement"):
+                if payload is None:
+                    records = []
+                    for station in cache.stations:
+                        records += db.get_latest_by_station(limit=cache.size, station=station)
+                    cache.load(records)
+                else:
+                    cache.append(Measurement.from_json(payload))
+        except DatabaseError as er:
+            logging.error(str(er) + ", retrying in 5 seconds")
+        except Exception:
+            # anything else would end the greenlet and leave the cache frozen
+            logging.exception("Listener failed, retrying in 5 seconds")
+
+        cache.invalidate()
+        gevent.sleep(5)
+
+
+def dumps(payload):
+    if orjson:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def respond(build, conditional=True):
+    # Answer with the JSON payload returned by build(). The validators are derived
+    # from the latest measurement, while nothing changed clients get a 304 without
+    # the payload being built at all
+    latest = cache.latest(1) if cache.ready and conditional else []
+    etag = None
+    if latest:
+        etag = str(latest[0].id) + "-" + str(zlib.crc32(request.query_string))
+        if etag in request.if_none_match or (not request.if_none_match and request.if_modified_since
+                                             and latest[0].timestamp.replace(microsecond=0) <= request.if_modified_since):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    result = build()
+    if isinstance(result, tuple):
+        # error message and status code
+        return result
+
+    response = Response(dumps(result), mimetype="application/json")
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    if etag:
+        response.set_etag(etag)
+        response.last_modified = latest[0].timestamp
+
+    if len(response.data) > GZIP_MIN_SIZE and "gzip" in request.accept_encodings:
+        response.data = gzip.compress(response.data, compresslevel=5)
+        response.headers["Content-Encoding"] = "gzip"
+
+    return response
+
+
+def measurement_event(measurement):
+    data = dumps({
+        "id": measurement.id,
+        "station": measurement.station,
+        "timestamp": measurement.timestamp.timestamp(),
+        "temperature": measurement.temperature,
+        "humidity": measurement.humidity
+    }).decode()
+    return "id: " + str(measurement.id) + "\nevent: measurement\ndata: " + data + "\n\n"
+
+
+def stream_measurements(last_id=None):
+    # Server-Sent Events with every new measurement. A reconnecting client
+    # sends the id of its last event and gets the measurements it missed
+    queue = Queue(maxsize=100)
+
+    def subscriber(measurement):
+        try:
+            queue.put_nowait(measurement)
+        except Full:
+            # the client is too slow, it will reload the chart on reconnect
+            pass
+
+    cache.subscribe(subscriber)
+    try:
+        missed = cache.since(last_id) if last_id is not None else []
+        last_id = cache.last_id
+
+        yield "retry: 5000\n\n"
+        for measurement in missed:
+            yield measurement_event(measurement)
+
+        while True:
+            try:
+                measurement = queue.get(timeout=15)
+            except Empty:
+                # keep proxies from closing the idle connection
+                yield ": keep-alive\n\n"
+                continue
+
+            # skip measurements which were already sent as missed ones
+            if measurement.id <= last_id:
+                continue
+            last_id = measurement.id
+
+            yield measurement_event(measurement)
+    finally:
+        cache.unsubscribe(subscriber)
 
 
 class Measurements(Resource):
 
     def get(self):
-        records = db.get_measurement(limit=10)
-
-        result = {}
-        for record in records:
-            sid = record[0]
-            timestamp = record[1]
-            station = record[2]
-            temperature = record[3]
-            humidity = record[4]
-
-            result[sid] = {
-                "timestamp": timestamp,
-                "station": station,
-                "temperature": temperature,
-                "humidity": humidity
-            }
+        return respond(self.latest)
+
+    @staticmethod
+    def latest():
+        # columnar, newest measurement first
+        records = latest_measurements(limit=10)
+        return {
+            "id": [record.id for record in records],
+            "station": [record.station for record in records],
+            "timestamp": [record.timestamp.timestamp() for record in records],
+            "temperature": [record.temperature for record in records],
+            "humidity": [record.humidity for record in records]
+        }
+
+
+def parse_time(value):
+    # epoch seconds or ISO 8601
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except ValueError:
+        time = datetime.fromisoformat(value)
+        return time if time.tzinfo else time.astimezone()
 
-        json = jsonify(result)
-        return json
+
+def chart_resolution(start, end, resolution=None):
+    # the smallest offered resolution, which isn't finer than requested and
+    # keeps the number of buckets below MAX_POINTS
+    span = (end - start).total_seconds()
+    for candidate in RESOLUTIONS:
+        if candidate >= (resolution or 0) and span / candidate <= MAX_POINTS:
+            return candidate
+    return RESOLUTIONS[-1]
 
 
 class MeasurementsChart(Resource):
+    # Without parameters the latest measurements of every station are returned.
+    # With from, to and/or resolution the measurements are aggregated into buckets
     def get(self):
-        temp_time_t1 = db.get_measurement_by_station(limit=30, station="T1")
-        temp_time_t2 = db.get_measurement_by_station(limit=30, station="T2")
+        # a window relative to now changes without new measurements
+        relative = "from" not in request.args and any(key in request.args for key in ("to", "resolution"))
+        return respond(self.build, conditional=not relative)
+
+    def build(self):
+        if not any(key in request.args for key in ("from", "to", "resolution")):
+            return self.latest()
+
+        try:
+            end = parse_time(request.args["to"]) if "to" in request.args else datetime.now(timezone.utc)
+            start = parse_time(request.args["from"]) if "from" in request.args else end - timedelta(days=1)
+            resolution = int(request.args["resolution"]) if "resolution" in request.args else None
+        except (ValueError, OverflowError, OSError):
+            # not a number or date, or out of the range of datetime
+            return {"message": "from/to must be epoch seconds or ISO 8601, resolution seconds"}, 400
 
-        labels = []
-        t1 = []
-        h1 = []
-        t2 = []
-        h2 = []
+        if start >= end:
+            return {"message": "from must be before to"}, 400
 
-        for temp, hum, time in temp_time_t1:
-            t1.append({"x": time, "y": temp})
-            h1.append({"x": time, "y": hum})
-            labels.append(time)
+        return self.aggregated(start, end, chart_resolution(start, end, resolution))
+
+    @staticmethod
+    def latest():
+        stations = {}
+        for station in cache.stations:
+            measurements = station_measurements(station)
+            stations[station] = {
+                "time": [m.timestamp.timestamp() for m in measurements],
+                "temperature": [m.temperature for m in measurements],
+                "humidity": [m.humidity for m in measurements]
+            }
 
-        for temp, hum, time in temp_time_t2:
-            t2.append({"x": time, "y": temp})
-            h2.append({"x": time, "y": hum})
-            labels.append(time)
+        return {"resolution": 0, "stations": stations}
 
-        labels = list(dict.fromkeys(labels))
-        labels.sort()
+    @staticmethod
+    def aggregated(start, end, resolution):
+        columns = ["time", "temperature_min", "temperature", "temperature_max",
+                   "humidity_min", "humidity", "humidity_max"]
+        stations = {station: {column: [] for column in columns} for station in cache.stations}
 
-        result = {"t1": t1,
-                  "t2": t2,
-                  "h1": h1,
-                  "h2": h2,
-                  "labels": labels}
+        for record in db.get_aggregates(start, end, resolution, stations=cache.stations):
+            station = stations[record[0]]
+            for column, value in zip(columns, record[1:]):
+                # aggregates of a column without values are NULL
+                station[column].append(value if column == "time" or value is None else round(value, 2))
 
-        json = jsonify(result)
-        return json
+        return {"resolution": resolution,
+                "from": start.timestamp(),
+                "to": end.timestamp(),
+                "stations": stations}
 
 
 def run_server():
+    db.connect()
+
     app = Flask(__name__, static_url_path='/static')
 
     stream_handler = logging.StreamHandler()
-    stream_formatter = logging.Formatter('%(levelname)s: %(msg)s')
+    stream_formatter = logging.Formatter('%(levelname)s: %(message)s')
     stream_handler.setFormatter(stream_formatter)
 
     logger = logging.getLogger()
@@ -81,9 +266,24 @@ def run_server():
     def index():
         return redirect('/static/index.html')
 
+    @app.route('/stream')
+    def stream():
+        last_id = request.headers.get("Last-Event-ID")
+        last_id = int(last_id) if last_id and last_id.isdigit() else None
+
+        return Response(stream_measurements(last_id), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route('/metrics')
+    def export_metrics():
+        # counters of the decoder process, shared through memory
+        return Response(metrics.registry.expose(), mimetype="text/plain; version=0.0.4")
+
     api = Api(app)
     api.add_resource(Measurements, '/measurements')
     api.add_resource(MeasurementsChart, '/chart')
 
+    gevent.spawn(listen)
+
     http_server = WSGIServer(("0.0.0.0", 8080), app, log=logger)
     http_server.serve_forever()
\ No newline at end of file
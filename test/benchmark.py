@@ -0,0 +1,204 @@
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+import metrics
+from decoder import SignalGroup, SignalDecoder
+from database import MeasurementWriter
+from piscope.decoder import Decoder
+from replay import MemoryStorage, encode_frame, synthesize, replay, percentile
+
+# Benchmarks of the decoding and storage path on synthetic 433Mhz transmissions.
+# Run from the repository root: PYTHONPATH=. python test/benchmark.py
+
+
+def readings(count):
+    # frames of alternating stations with slowly changing values
+    return [encode_frame(station="T1" if i % 2 else "T2",
+                         temperature=round(15 + (i % 100) / 10, 1),
+                         humidity=round(40 + (i % 40) / 2, 1)) for i in range(count)]
+
+
+def bench_decode(frames, jitter, drop, interleave=False, sensors=4):
+    # SignalDecoder.decode, fed like the live decoder process. With interleave,
+    # the frames of several sensors are transmitted at the same time
+    if interleave:
+        frames = [encode_frame(station="T1" if i % 2 else "T2", channel=i % sensors,
+                               temperature=round(15 + (i // sensors % 100) / 10, 1)) for i in range(len(frames))]
+        transmissions = [frames[i:i + sensors] for i in range(0, len(frames), sensors)]
+        edges = []
+        for i, transmission in enumerate(transmissions):
+            start = edges[-1][0] + 100000 if edges else 0
+            edges += synthesize(transmission, repeats=15, start=start, jitter=jitter, drop=drop,
+                                interleave=True, seed=i)
+    else:
+        edges = list(synthesize(frames, jitter=jitter, drop=drop, seed=1))
+    storage, stats = replay(edges)
+    return {"edges_per_second": stats["edges_per_second"],
+            "frames_per_second": stats["frames_per_second"],
+            "decode_p50_us": stats["decode_p50_us"],
+            "decode_p99_us": stats["decode_p99_us"],
+            "decoded_ratio": stats["frames"] / len(frames)}
+
+
+def bench_allocations(frames):
+    # peak memory allocated while a transmission is decoded
+    decoder = SignalDecoder(None, MemoryStorage(), autostart=False)
+    decoder.output = False
+    decoder.open()
+
+    transmissions = [list(synthesize([frame], start=i * 1000000)) for i, frame in enumerate(frames)]
+    peaks = []
+    tracemalloc.start()
+    for edges in transmissions:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for edge in edges:
+            decoder.decode(edge)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    decoder.shutdown()
+    return {"peak_bytes_per_frame": sum(peaks) / len(peaks)}
+
+
+def bench_group(frames, repeats=6):
+    # SignalGroup.validate and compute of complete groups
+    groups = []
+    for frame in frames:
+        group = SignalGroup()
+        for _ in range(repeats):
+            for position in range(35, -1, -1):
+                group.append((frame >> position) & 1)
+            group.add()
+        groups.append(group)
+
+    latencies = []
+    for group in groups:
+        before = time.perf_counter()
+        group.validate()
+        latencies.append(time.perf_counter() - before)
+
+    return {"validate_p50_us": percentile(latencies, 50) * 1000000,
+            "validate_p99_us": percentile(latencies, 99) * 1000000,
+            "groups_per_second": len(groups) / sum(latencies)}
+
+
+def bench_piscope(frames):
+    # piscope.decoder.Decoder, streaming and batch mode
+    with tempfile.NamedTemporaryFile("w", suffix=".dump", delete=False) as capture:
+        capture.write("#piscope\n")
+        for tick, level in synthesize(frames):
+            capture.write(str(tick) + (" 1080C1FF\n" if level else " 1000C1FF\n"))
+
+    try:
+        edges = sum(1 for _ in synthesize(frames))
+        decoder = Decoder()
+
+        before = time.perf_counter()
+        for _ in decoder.iter_decode(capture.name):
+            pass
+        streaming = time.perf_counter() - before
+
+        result = {"streaming_edges_per_second": edges / streaming}
+        try:
+            before = time.perf_counter()
+            decoder.decode_batch(capture.name)
+            result["batch_edges_per_second"] = edges / (time.perf_counter() - before)
+        except ImportError:
+            pass
+        return result
+    finally:
+        os.remove(capture.name)
+
+
+def bench_insert(count, database):
+    # MeasurementWriter into MemoryStorage, or with --db into a throwaway
+    # schema of the database, which is dropped afterwards
+    if database:
+        from database import DatabaseConnector
+        storage = DatabaseConnector(schema="benchmark", retention=None)
+        storage.connect()
+        storage.drop_schema()
+        storage.setup()
+
+        # keep the API from receiving the benchmark measurements
+        with storage.cursor() as cursor:
+            cursor.execute("ALTER TABLE measurement DISABLE TRIGGER measurement_notify;")
+    else:
+        storage = MemoryStorage()
+
+    try:
+        writer = MeasurementWriter(storage, maintenance_interval=3600 * 24)
+        writer.start()
+
+        start = datetime.now(timezone.utc) - timedelta(seconds=count)
+        rows = [("T1", start + timedelta(seconds=i), 20.0, 50.0, frame) for i, frame in enumerate(readings(count))]
+        errors = metrics.write_errors.get()
+        before = time.perf_counter()
+        for row in rows:
+            writer.put(*row)
+        writer.stop()
+        duration = time.perf_counter() - before
+
+        if metrics.write_errors.get() > errors:
+            raise RuntimeError("Measurements couldn't be written, the result is meaningless")
+    finally:
+        if database:
+            storage.drop_schema()
+            storage.disconnect()
+
+    return {"rows_per_second": count / duration}
+
+
+def compare(results, baseline):
+    for suite, values in results.items():
+        for key, value in values.items():
+            previous = baseline.get(suite, {}).get(key)
+            if previous:
+                change = (value - previous) / previous * 100
+                print("{:<12} {:<28} {:>14.2f} {:>+8.1f}%".format(suite, key, value, change))
+            else:
+                print("{:<12} {:<28} {:>14.2f}".format(suite, key, value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Decoder benchmarks on synthetic 433Mhz transmissions")
+    parser.add_argument("-n", "--frames", type=int, default=500, help="Number of synthetic readings")
+    parser.add_argument("-j", "--jitter", type=int, default=50, help="Pulse jitter in µs")
+    parser.add_argument("-p", "--drop", type=float, default=0.001, help="Probability of a lost edge")
+    parser.add_argument("--db", action="store_true",
+                        help="Benchmark inserts into the database (in the schema benchmark, which is dropped)")
+    parser.add_argument("--save", help="Save the results as baseline (JSON)")
+    parser.add_argument("--compare", help="Compare the results with a saved baseline (JSON)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    gc.collect()
+
+    frames = readings(args.frames)
+    results = {
+        "decode": bench_decode(frames, args.jitter, args.drop),
+        "interleaved": bench_decode(frames, args.jitter, args.drop, interleave=True),
+        "allocations": bench_allocations(frames[:100]),
+        "group": bench_group(frames),
+        "piscope": bench_piscope(frames),
+        "insert": bench_insert(args.frames * 10, args.db)
+    }
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f_obj:
+            baseline = json.load(f_obj)
+    compare(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f_obj:
+            json.dump(results, f_obj, indent=2)
+        print("Saved baseline to " + args.save, file=sys.stderr)
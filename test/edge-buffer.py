@@ -0,0 +1,46 @@
+import unittest
+from queue import Queue
+from transport import TICKS_MASK, EdgeBuffer
+
+
+class EdgeBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = Queue()
+        self.buffer = EdgeBuffer(self.queue, capacity=4)
+
+    def received(self):
+        edges = []
+        while not self.queue.empty():
+            edges += EdgeBuffer.unpack(self.queue.get())
+        return edges
+
+    def test_round_trip(self):
+        edges = [(0, 1), (250, 0), (TICKS_MASK, 1)]
+        for edge in edges:
+            self.buffer.append(*edge)
+        self.buffer.flush()
+        self.assertEqual(self.received(), edges)
+
+    def test_full(self):
+        # a full buffer is shipped at once, without waiting for a flush
+        edges = [(tick, tick % 2) for tick in range(6)]
+        for edge in edges:
+            self.buffer.append(*edge)
+        self.assertEqual(self.queue.qsize(), 1)
+
+        self.buffer.flush()
+        self.assertEqual(self.received(), edges)
+
+    def test_flush_empty(self):
+        self.buffer.flush()
+        self.assertTrue(self.queue.empty())
+
+    def test_flush_thread(self):
+        self.buffer.start()
+        self.buffer.append(10, 1)
+        self.buffer.stop()
+        self.assertEqual(self.received(), [(10, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
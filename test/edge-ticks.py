@@ -0,0 +1,33 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from transport import TICKS_MASK, ticks_us, ticks_diff, ticks_datetime
+
+
+class TicksTestCase(unittest.TestCase):
+    def test_ticks_us(self):
+        tick = ticks_us()
+        self.assertTrue(0 <= tick <= TICKS_MASK)
+
+    def test_diff(self):
+        self.assertEqual(ticks_diff(1500, 1000), 500)
+        self.assertEqual(ticks_diff(1000, 1000), 0)
+
+    def test_diff_wraparound(self):
+        self.assertEqual(ticks_diff(100, TICKS_MASK - 99), 200)
+        self.assertEqual(ticks_diff(0, TICKS_MASK), 1)
+
+    def test_datetime(self):
+        expected = datetime.now(timezone.utc) - timedelta(seconds=1)
+        timestamp = ticks_datetime((ticks_us() - 1000000) & TICKS_MASK)
+        self.assertIsNotNone(timestamp.tzinfo)
+        self.assertAlmostEqual(timestamp.timestamp(), expected.timestamp(), delta=0.05)
+
+    def test_datetime_ahead(self):
+        # ticks slightly ahead of the counter are in the future, not ~71 minutes ago
+        expected = datetime.now(timezone.utc) + timedelta(seconds=1)
+        timestamp = ticks_datetime((ticks_us() + 1000000) & TICKS_MASK)
+        self.assertAlmostEqual(timestamp.timestamp(), expected.timestamp(), delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
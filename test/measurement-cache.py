@@ -0,0 +1,43 @@
+import unittest
+from datetime import datetime, timezone
+from cache import Measurement, MeasurementCache
+
+NOW = datetime.now(timezone.utc)
+
+
+def record(id, station="T1"):
+    return id, station, NOW, 20.0, 50.0
+
+
+class MeasurementCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = MeasurementCache(size=3)
+        self.cache.load([record(1), record(2, "T2")])
+        self.received = []
+        self.cache.subscribe(self.received.append)
+
+    def test_load(self):
+        self.assertTrue(self.cache.ready)
+        self.assertEqual([m.id for m in self.cache.latest()], [2, 1])
+        self.assertEqual([m.id for m in self.cache.station("T1")], [1])
+
+    def test_append(self):
+        self.cache.append(Measurement._make(record(3)))
+        self.cache.append(Measurement._make(record(3)))
+        self.assertEqual([m.id for m in self.received], [3])
+
+    def test_size(self):
+        for id in range(3, 7):
+            self.cache.append(Measurement._make(record(id)))
+        self.assertEqual([m.id for m in self.cache.station("T1")], [4, 5, 6])
+
+    def test_reload(self):
+        # measurements inserted while the listener reconnected reach the subscribers
+        self.cache.invalidate()
+        self.cache.load([record(1), record(2, "T2"), record(3), record(4, "T2")])
+        self.assertEqual([m.id for m in self.received], [3, 4])
+        self.assertEqual(self.cache.last_id, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
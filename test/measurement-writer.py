@@ -0,0 +1,65 @@
+import time
+import logging
+import unittest
+from unittest import mock
+from datetime import datetime, timezone
+import psycopg2
+from database import DatabaseConnector, DatabaseError, DatabaseUnavailableError, MeasurementWriter
+
+NOW = datetime.now(timezone.utc)
+
+
+class RejectingStorage:
+    # accepts every row, except the ones without a timestamp
+    def __init__(self):
+        self.measurements = []
+
+    def add_measurements(self, measurements):
+        if any(measurement[1] is None for measurement in measurements):
+            raise DatabaseError("null value in column timestamp")
+        self.measurements += measurements
+
+
+class MeasurementWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def unavailable(self):
+        # a connector whose connections are refused
+        return mock.patch("psycopg2.connect", side_effect=psycopg2.OperationalError("connection refused"))
+
+    def test_unavailable(self):
+        # measurements are kept while the database can't be reached
+        db = DatabaseConnector()
+        writer = MeasurementWriter(db)
+        measurements = [("T1", NOW, 20.0, 50.0, 1), ("T2", NOW, 21.0, 40.0, 2)]
+        with self.unavailable():
+            with self.assertRaises(DatabaseUnavailableError):
+                db.connect()
+            self.assertEqual(writer._flush(measurements), measurements)
+
+    def test_backoff(self):
+        db = DatabaseConnector()
+        writer = MeasurementWriter(db)
+        with self.unavailable():
+            with self.assertRaises(DatabaseUnavailableError):
+                db.connect()
+            writer._flush([("T1", NOW, 20.0, 50.0, 1)])
+            self.assertGreater(writer._retry_at, time.monotonic())
+            writer._flush([("T1", NOW, 20.0, 50.0, 1)])
+            self.assertEqual(writer._backoff, 2 * writer.retry_interval)
+
+    def test_rejected(self):
+        # a row the database refuses doesn't block the others
+        storage = RejectingStorage()
+        writer = MeasurementWriter(storage)
+        measurements = [("T1", NOW, 20.0, 50.0, 1), ("T1", None, 20.0, 50.0, 2), ("T1", NOW, 20.0, 50.0, 3)]
+        self.assertEqual(writer._flush(measurements), [])
+        self.assertEqual([measurement[4] for measurement in storage.measurements], [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from protocols import Protocol, ProtocolRegistry, TEKO
+
+# T1, channel 9, battery ok, 21.5 degree, 40% humidity
+FRAME = 0b100101000010010100110100001011110000
+
+
+def protocol(name="Other", **kwargs):
+    options = dict(pulse_length=[0, 250, 500, 750], bit=500, sync=750, frame_length=24,
+                   preamble=0b1010, preamble_length=4, fields={"station": (4, 8, str)})
+    options.update(kwargs)
+    return Protocol(name, **options)
+
+
+class ProtocolRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = ProtocolRegistry()
+        self.registry.register(TEKO)
+
+    def test_match(self):
+        self.assertIs(self.registry.match(36, FRAME), TEKO)
+        self.assertIsNone(self.registry.match(35, FRAME >> 1))
+
+    def test_match_preamble(self):
+        other = self.registry.register(protocol())
+        self.assertIs(self.registry.match(24, 0b1010 << 20), other)
+        self.assertIsNone(self.registry.match(24, 0b0101 << 20))
+
+    def test_match_longest_preamble(self):
+        short = self.registry.register(protocol("Short", preamble=0b1, preamble_length=1))
+        long = self.registry.register(protocol("Long", preamble=0b10, preamble_length=2))
+        self.assertIs(self.registry.match(24, 0b10 << 22), long)
+        self.assertIs(self.registry.match(24, 0b11 << 22), short)
+
+    def test_pulse_length(self):
+        self.registry.register(protocol(pulse_length=[0, 250, 500, 1200], sync=1200))
+        self.assertEqual(self.registry.pulse_length, [0, 250, 500, 750, 1200])
+        self.assertEqual(self.registry.syncs, {750, 1200})
+        self.assertEqual(self.registry.quantizer.quantize(1150), 1200)
+
+    def test_conflicting_role(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(protocol(bit=250))
+        self.assertEqual(len(self.registry.protocols), 1)
+
+    def test_overlapping_pulse_length(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(protocol(pulse_length=[300, 500, 750]))
+
+    def test_ambiguous(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(protocol(frame_length=36, preamble=0, preamble_length=0))
+
+    def test_station(self):
+        with self.assertRaises(ValueError):
+            protocol(fields={})
+
+    def test_decode(self):
+        values = TEKO.decode(FRAME)
+        self.assertEqual(values["station"], "T1")
+        self.assertEqual(values["channel"], 9)
+        self.assertEqual(values["temperature"], 21.5)
+        self.assertEqual(values["humidity"], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import random
+import unittest
+from quantizer import Quantizer, np
+
+
+class QuantizerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.quantizer = Quantizer([0, 250, 500, 750], tolerance=100)
+
+    def test_quantize(self):
+        self.assertEqual(self.quantizer.quantize(0), 0)
+        self.assertEqual(self.quantizer.quantize(230), 250)
+        self.assertEqual(self.quantizer.quantize(600), 500)
+        self.assertEqual(self.quantizer.quantize(650), 750)
+
+    def test_reject(self):
+        # between the tolerance windows of 0 and 250, 250 and 500
+        self.assertIsNone(self.quantizer.quantize(101))
+        self.assertIsNone(self.quantizer.quantize(149))
+        self.assertIsNone(self.quantizer.quantize(375))
+        self.assertIsNone(self.quantizer.quantize(-1))
+
+    def test_tie(self):
+        # ties go to the shorter class
+        quantizer = Quantizer([250, 500], tolerance=200)
+        self.assertEqual(quantizer.quantize(375), 250)
+        self.assertEqual(quantizer.quantize(376), 500)
+
+    def test_open_ended(self):
+        self.assertEqual(self.quantizer.quantize(10000), 750)
+        self.assertEqual(self.quantizer.quantize(2 ** 32 - 1), 750)
+
+        quantizer = Quantizer([0, 250, 500, 750], tolerance=100, open_ended=False)
+        self.assertEqual(quantizer.quantize(850), 750)
+        self.assertIsNone(quantizer.quantize(851))
+        self.assertIsNone(quantizer.quantize(10000))
+
+    def test_unsorted_tolerance(self):
+        quantizer = Quantizer([750, 250], tolerance=[50, 10])
+        self.assertEqual(quantizer.pulse_length, [250, 750])
+        self.assertEqual(quantizer.tolerance, [10, 50])
+        self.assertEqual(quantizer.quantize(700), 750)
+        self.assertIsNone(quantizer.quantize(280))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_quantize_array(self):
+        for quantizer in (self.quantizer, Quantizer([250, 500], tolerance=200),
+                          Quantizer([0, 250, 500, 750], tolerance=[20, 100, 50, 100], open_ended=False)):
+            durations = list(range(-5, 1200)) + [random.randrange(2 ** 32) for _ in range(100)]
+            expected = [quantizer.quantize(duration) for duration in durations]
+            expected = [-1 if duration is None else duration for duration in expected]
+            self.assertEqual(quantizer.quantize_array(durations).tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import logging
+import unittest
+from replay import read_capture, encode_frame, synthesize, replay
+
+CAPTURE = os.path.join(os.path.dirname(__file__), "..", "piscope", "raw_dump")
+
+
+class ReplayDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_capture(self):
+        # a real transmission of 15 repetitions is saved once
+        storage, stats = replay(read_capture(CAPTURE))
+        self.assertEqual(len(storage.measurements), 1)
+        station, timestamp, temperature, humidity, frame = storage.measurements[0]
+        self.assertEqual(station, "T1")
+        self.assertEqual(temperature, 20.4)
+
+    def test_repeats(self):
+        frame = encode_frame("T2", temperature=21.5, humidity=40)
+        storage, stats = replay(synthesize([frame], repeats=15))
+        self.assertEqual([m[4] for m in storage.measurements], [frame])
+
+    def test_interleave(self):
+        frames = [encode_frame("T1", 20.0), encode_frame("T2", 25.0), encode_frame("T1", 18.0, channel=3)]
+        storage, stats = replay(synthesize(frames, repeats=15, interleave=True))
+        self.assertEqual(sorted(m[4] for m in storage.measurements), sorted(frames))
+
+    def test_interleave_lost_parts(self):
+        # four sensors, a lost repetition leaves a gap of ~200ms between two parts of a sensor
+        frames = [encode_frame("T1" if i % 2 else "T2", 15.0, channel=i) for i in range(4)]
+        storage, stats = replay(synthesize(frames, repeats=15, drop=0.001, jitter=50, interleave=True, seed=10))
+        self.assertEqual(sorted(m[4] for m in storage.measurements), sorted(frames))
+
+    def test_interleave_same_station(self):
+        # two sensors of station T1 on different channels, far apart in temperature
+        frames = [encode_frame("T1", 20.0, channel=9), encode_frame("T1", 35.0, channel=3)]
+        edges = list(synthesize(frames, repeats=15, interleave=True))
+        edges += synthesize(frames, repeats=15, start=edges[-1][0] + 1000000, interleave=True)
+        storage, stats = replay(edges)
+        self.assertEqual(sorted(m[4] for m in storage.measurements), sorted(frames * 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
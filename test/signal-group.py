@@ -1,95 +1,105 @@
 import unittest
-from datetime import datetime
-from decoder import SignalGroup
+from decoder import SignalGroup, SignalPart
+from transport import ticks_us
+
+# T1, channel 9, battery ok, 21.5 degree, 40% humidity
+FRAME = "100101000010010100110100001011110000"
 
 
 class SignalGroupTestCase(unittest.TestCase):
     def setUp(self):
         self.group = SignalGroup()
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(1)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(0)
-        self.group.append(1)
+        self.append_frame(FRAME, repeats=3)
 
     def tearDown(self):
         self.group = None
 
+    def append_frame(self, frame, repeats=1):
+        for _ in range(repeats):
+            for bit in frame:
+                self.group.append(int(bit))
+            self.group.add(ticks_us())
+
     def test_append(self):
         self.group.append(1)
-        self.assertEqual(self.group.bits, [0, 0, 1, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+        self.group.append(0)
+        self.assertEqual(self.group.parts[-1].bits, [1, 0])
 
     def test_add(self):
+        self.assertEqual(len(self.group), 4)
         self.group.add()
-        self.assertEqual(len(self.group.parts), 2)
-        self.group.add()
-        self.assertEqual(len(self.group.parts), 2)
+        self.assertEqual(len(self.group), 4)
+
+    def test_insert(self):
+        part = SignalPart()
+        for bit in FRAME:
+            part.append(int(bit))
+        self.assertTrue(self.group.insert(part, ticks_us()))
+        self.assertEqual(len(self.group), 5)
+        self.assertEqual(len(self.group.parts[-1]), 0)
+        self.assertTrue(self.group.validate())
+        self.assertEqual(self.group.votes, 4)
+
+        self.group.close()
+        self.assertFalse(self.group.insert(part))
 
     def test_validate(self):
         self.assertTrue(self.group.validate())
+        self.assertEqual(self.group.votes, 3)
+        self.assertEqual(self.group.confidence, 1)
+
+    def test_validate_quorum(self):
+        self.group = SignalGroup()
+        self.append_frame(FRAME, repeats=2)
+        self.assertFalse(self.group.validate())
+
+    def test_majority(self):
+        self.append_frame("100101000010010100110100001011110001", repeats=2)
+        self.assertTrue(self.group.validate())
+        self.assertEqual(self.group.bitstring, FRAME)
+        self.assertEqual(self.group.confidence, 3 / 5)
+
+    def test_complete(self):
+        self.assertTrue(self.group.complete)
 
     def test_station(self):
-        self.assertEqual(self.group.station, "0010")
+        self.group.validate()
+        self.assertEqual(self.group.station, "T1")
 
     def test_channel(self):
-        self.assertEqual(self.group.channel, "00")
+        self.group.validate()
+        self.assertEqual(self.group.channel, 9)
 
-    def test_id(self):
-        self.assertEqual(self.group.id, "11")
-
-    def test_voltage(self):
-        self.assertEqual(self.group.battery, "0")
+    def test_battery(self):
+        self.group.validate()
+        self.assertEqual(self.group.battery, "OK")
 
     def test_temperature(self):
-        self.assertEqual(self.group.temperature, 0)
+        self.group.validate()
+        self.assertEqual(self.group.temperature, 21.5)
 
     def test_humidity(self):
-        self.assertEqual(self.group.humidity, 48)
+        self.group.validate()
+        self.assertEqual(self.group.humidity, 40)
 
     def test_bitstring(self):
-        self.assertEqual(self.group.bitstring, "001000110010000011110100100111111110")
+        self.group.validate()
+        self.assertEqual(self.group.bitstring, FRAME)
+        self.assertEqual(self.group.bitstring_nice, "1001 01 00 00 10 0101 0011 0100 0010 1111 00 00")
 
-    def test_datestring(self):
-        self.assertEqual(self.group.datestring, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    def test_timestamp(self):
+        self.assertIsNotNone(self.group.timestamp)
+        self.assertIsNotNone(self.group.timestamp.tzinfo)
 
     def test_valid(self):
         self.assertTrue(self.group.valid)
 
+    def test_valid_invalidated(self):
+        self.assertTrue(self.group.valid)
+        self.group.delete(0)
+        self.group.delete(0)
+        self.assertFalse(self.group.valid)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -15,12 +15,14 @@ class TestSignalPart(unittest.TestCase):
             self.part.append(bit)
 
         # Assert
-        self.assertEqual(self.part._bits, expected_bits)
+        self.assertEqual(self.part.bits, expected_bits)
+        self.assertEqual(self.part.frame, 0b1001)
 
     def test_delete(self):
         # Arrange
         bits = [1, 0, 0, 1]
-        self.part._bits = bits.copy()
+        for bit in bits:
+            self.part.append(bit)
 
         expected_bits = [1, 0, 1]
 
@@ -28,12 +30,13 @@ class TestSignalPart(unittest.TestCase):
         self.part.delete(2)
 
         # Assert
-        self.assertEqual(self.part._bits, expected_bits)
+        self.assertEqual(self.part.bits, expected_bits)
+        self.assertEqual(len(self.part), 3)
 
     def test_validate_valid(self):
         # Arrange
-        bits = [1] * 36
-        self.part._bits = bits.copy()
+        for bit in [1] * 36:
+            self.part.append(bit)
 
         # Act
         is_valid = self.part.validate()
@@ -44,8 +47,8 @@ class TestSignalPart(unittest.TestCase):
 
     def test_validate_invalid(self):
         # Arrange
-        bits = [1] * 35
-        self.part._bits = bits.copy()
+        for bit in [1] * 35:
+            self.part.append(bit)
 
         # Act
         is_valid = self.part.validate()
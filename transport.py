@@ -0,0 +1,98 @@
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+# edge timestamps are 32 bit microsecond ticks, which wrap every ~71 minutes
+TICKS_MASK = 0xFFFFFFFF
+
+
+def ticks_us():
+    # monotonic microsecond counter, shared by all processes on this machine
+    return (time.monotonic_ns() // 1000) & TICKS_MASK
+
+
+def ticks_diff(end, start):
+    # duration between two ticks, correct across a wraparound of the counter
+    return (end - start) & TICKS_MASK
+
+
+def ticks_datetime(tick):
+    # wall clock time (UTC) of a tick taken less than half a wraparound ago (or ahead)
+    age = ticks_diff(ticks_us(), tick)
+    if age > TICKS_MASK // 2:
+        age -= TICKS_MASK + 1
+    return datetime.now(timezone.utc) - timedelta(microseconds=age)
+
+
+class EdgeBuffer:
+    # Collects GPIO edges in a fixed-size buffer and ships them to the
+    # decoder process as packed arrays of [timestamp, level, timestamp, level, ...]
+
+    def __init__(self, queue, capacity=512, flush_interval=0.01):
+        # message queue of the decoder process
+        self.queue = queue
+
+        # maximum number of edges held before the buffer is shipped
+        self.capacity = capacity
+
+        # maximum time (seconds) an edge waits in the buffer
+        self.flush_interval = flush_interval
+
+        self._edges = array('I', bytes(capacity * 2 * array('I').itemsize))
+        self._length = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def append(self, timestamp, level):
+        payload = None
+        with self._lock:
+            position = self._length * 2
+            self._edges[position] = timestamp
+            self._edges[position + 1] = level
+            self._length += 1
+
+            # ship a full buffer directly, this only happens if
+            # the flush thread can't keep up with the edges
+            if self._length == self.capacity:
+                payload = self._take()
+
+        if payload:
+            self.queue.put(payload)
+
+    def flush(self):
+        with self._lock:
+            payload = self._take()
+
+        if payload:
+            self.queue.put(payload)
+
+    def _take(self):
+        # copy the buffered edges and reset the buffer, the queue
+        # is written outside the lock to never block the GPIO callback
+        payload = self._edges[:self._length * 2].tobytes()
+        self._length = 0
+        return payload
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @staticmethod
+    def unpack(payload):
+        edges = array('I')
+        edges.frombytes(payload)
+        return zip(edges[0::2], edges[1::2])